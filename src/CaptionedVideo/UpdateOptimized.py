@@ -1,19 +1,33 @@
 import os
 import sys
 import pysrt
-from moviepy.editor import VideoFileClip, ImageClip, CompositeVideoClip, AudioFileClip, TextClip, ColorClip, concatenate_videoclips
+from moviepy.editor import VideoFileClip, ImageClip, CompositeVideoClip, TextClip, ColorClip, concatenate_videoclips
 import numpy as np
 from moviepy.video.fx.all import fadein, fadeout
-from PIL import Image, ImageDraw, ImageFont, ImageColor
+from PIL import Image, ImageColor
 import moviepy.audio.fx.all as afx
 from moviepy.config import change_settings
-from moviepy.audio.AudioClip import CompositeAudioClip
 from concurrent.futures import ThreadPoolExecutor
 import multiprocessing
 import cairosvg
 import io
-
+import contextlib
+import tempfile
+import time
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+from audio_mix import AUDIO_FPS, Track, mix_tracks, sample_clip, write_clip_audio
+from background_cache import file_hash, get_cache_dir, load_resized_image, save_array
+from caption_cache import shared_cache as shared_caption_cache
+from caption_pool import rasterize_captions
 from font_theme import get_theme_colors
+from frame_profiler import FrameProfiler
+from frame_writer import write_clip
+from motion_effects import bounce_offset, wave_offset, zoom_clip
+from render_stats import RenderStats
+from segmented_render import count_frames, write_incremental, write_segmented
+from sprite_animation import animate_sprite
+from timeline import IndexedCompositeVideoClip, covers_frame, cull_occluded_layers, sprite_clip
 
 # Set the ImageMagick binary path based on the operating system
 if sys.platform.startswith('win'):
@@ -28,38 +42,50 @@ change_settings({"IMAGEMAGICK_BINARY": IMAGEMAGICK_BINARY})
 if not hasattr(Image, 'ANTIALIAS'):
     Image.ANTIALIAS = Image.LANCZOS
 
+VIDEO_SIZE = (1080, 1920)
+# Captions are laid out on a landscape canvas centered on the video
+CAPTION_CANVAS_SIZE = (1920, 1080)
+
 
-def create_svg_watermark(svg_path, video_size, watermark_size, opacity=1.0):
+def create_svg_watermark(svg_path, video_size, watermark_size, opacity=1.0, cache_dir=None):
     """
     Create a watermark clip from an SVG file, positioned at the top-left corner.
 
+    The watermark is a sprite cropped to the logo, so only its rectangle is
+    blended into each frame. The rasterized sprite is cached on disk by the
+    SVG's content hash, the sizes and the opacity.
+
     :param svg_path: Path to the SVG file
     :param video_size: Tuple of (width, height) of the video
     :param watermark_size: Tuple of (width, height) for the watermark
     :param opacity: Opacity of the watermark (0.0 to 1.0)
-    :return: ImageClip with the watermark positioned at the top-left
+    :param cache_dir: Root of the cache, defaults to background_cache.CACHE_DIR
+    :return: Sprite clip with the watermark positioned at the top-left
     """
-    # Convert SVG to PNG
-    png_data = cairosvg.svg2png(url=svg_path, output_width=watermark_size[0], output_height=watermark_size[1])
-
-    # Create PIL Image from PNG data
-    watermark_image = Image.open(io.BytesIO(png_data)).convert("RGBA")
+    position = (10, 0)
+    key = f'{file_hash(svg_path)}_{watermark_size[0]}x{watermark_size[1]}_{video_size[0]}x{video_size[1]}_o{opacity}.npy'
+    cached_path = os.path.join(get_cache_dir('watermarks', cache_dir), key)
 
-    # Apply opacity
-    watermark_image.putalpha(Image.eval(watermark_image.split()[3], lambda a: int(a * opacity)))
+    if not os.path.exists(cached_path):
+        # Convert SVG to PNG
+        png_data = cairosvg.svg2png(url=svg_path, output_width=watermark_size[0], output_height=watermark_size[1])
 
-    # Create a transparent image the size of the video
-    full_image = Image.new('RGBA', video_size, (0, 0, 0, 0))
+        # Create PIL Image from PNG data
+        watermark_image = Image.open(io.BytesIO(png_data)).convert("RGBA")
 
-    # Paste the watermark onto the full image at the top-left corner
-    full_image.paste(watermark_image, (10, 0), watermark_image)
+        # Apply opacity
+        watermark_image.putalpha(Image.eval(watermark_image.split()[3], lambda a: int(a * opacity)))
 
-    # Convert to numpy array
-    img_array = np.array(full_image)
+        # Paste onto a transparent image the size of the video, as the full-frame
+        # watermark layer was built, and keep the pasted rectangle
+        full_image = Image.new('RGBA', video_size, (0, 0, 0, 0))
+        full_image.paste(watermark_image, position, watermark_image)
+        box = (position[0], position[1],
+               min(video_size[0], position[0] + watermark_image.width),
+               min(video_size[1], position[1] + watermark_image.height))
+        save_array(cached_path, np.array(full_image.crop(box)))
 
-    # Create ImageClip
-    watermark_clip = ImageClip(img_array).set_duration(1)
-    return watermark_clip
+    return sprite_clip(np.load(cached_path)).set_duration(1).set_position(position)
 
 def scale_effect(t, duration, max_scale=1.1, scale_up=True):
     """
@@ -81,76 +107,141 @@ def create_background_image_sequence(config):
     transition_duration = transition_config.get('duration', 0.5)
     swoosh_sound_path = transition_config.get('sound_path', '')
     max_scale = transition_config.get('max_scale', 1.1)
+    cache_dir = config.get('cache_dir')
 
-    audio_clips = []
+    swoosh_tracks = []
     total_duration = sum(durations)
 
     def process_image(args):
         i, (image_path, duration) = args
         start_time = sum(durations[:i])
 
-        image_clip = (ImageClip(image_path)
+        image_clip = (ImageClip(load_resized_image(image_path, 1920, cache_dir=cache_dir))
                       .set_duration(total_duration - start_time)
                       .set_start(start_time)
-                      .resize(height=1920)
                       .set_position(('center', 'center')))
 
+        # Time from which this image hides everything below it
+        cover_time = start_time if covers_frame(image_clip, VIDEO_SIZE) else None
+
+        # Zoom first: it works on the still image, and the other animations
+        # only move or tint it, so the order does not change the result
+        if 'scale' in animations:
+            scale_up = i % 2 == 0
+            anchor = 'top' if 'slide_up' in animations and i > 0 else 'center'
+            image_clip = zoom_clip(image_clip, lambda t: scale_effect(t, duration, max_scale, scale_up),
+                                   max_scale, VIDEO_SIZE, anchor)
+
         for animation in animations:
             if animation == 'slide_up' and i > 0:
                 image_clip = image_clip.set_position(lambda t: ('center', max(0, 1920 - (t / transition_duration) * 1920)))
+                if cover_time is not None:
+                    cover_time = start_time + transition_duration
 
                 if swoosh_sound_path:
-                    swoosh_audio = AudioFileClip(swoosh_sound_path).set_start(start_time).set_duration(transition_duration)
-                    audio_clips.append(swoosh_audio)
-            elif animation == 'scale':
-                scale_up = i % 2 == 0
-                image_clip = image_clip.resize(lambda t: scale_effect(t, duration, max_scale, scale_up))
+                    swoosh_tracks.append(Track(swoosh_sound_path, start_time, transition_duration))
             elif animation == 'fade':
                 image_clip = fadein(image_clip, duration=0.5, initial_color=0.2).fadeout(duration=0.7)
 
-        return image_clip
+        # What the frames of this layer depend on, for incremental re-renders
+        image_clip.signature = ('background', file_hash(image_path), i, start_time, duration,
+                                tuple(animations), transition_duration, max_scale)
+        return image_clip, cover_time
 
     with ThreadPoolExecutor(max_workers=multiprocessing.cpu_count()) as executor:
-        background_clips = list(executor.map(process_image, enumerate(zip(image_paths, durations))))
-
-    return background_clips, audio_clips
+        processed = list(executor.map(process_image, enumerate(zip(image_paths, durations))))
 
-def create_high_quality_text_clip(text, font_path, font_size, color, stroke_width=0, stroke_color=None, bg_color=None):
-    canvas_size = (1920 * 2, 1080 * 2)
-    text_layer = Image.new('RGBA', canvas_size, (0, 0, 0, 0))
-    draw = ImageDraw.Draw(text_layer)
+    background_clips = cull_occluded_layers([clip for clip, _ in processed], [cover for _, cover in processed])
 
-    font = ImageFont.truetype(font_path, font_size * 2)
+    return background_clips, swoosh_tracks
 
-    text_bbox = draw.textbbox((0, 0), text, font=font)
-    text_width = text_bbox[2] - text_bbox[0]
-    text_height = text_bbox[3] - text_bbox[1]
-
-    position = ((canvas_size[0] - text_width) // 2, (canvas_size[1] - text_height) // 2)
-
-    if stroke_width > 0:
-        for adj in range(stroke_width * 2):
-            x = position[0] + (adj - stroke_width)
-            y = position[1] + (adj - stroke_width)
-            draw.text((x, y), text, font=font, fill=stroke_color)
+def caption_clip(x, y, rgb, alpha):
+    """
+    Wrap a rendered caption in a sprite clip that remembers its canvas offset.
 
-    draw.text(position, text, font=font, fill=color)
+    The alpha stays with the sprite rather than in a mask clip, so the
+    compositor blends the caption in one pass. ``canvas_offset`` is where the
+    crop sits on the 1920x1080 caption canvas the text is laid out on; use
+    caption_position to place the clip.
 
-    text_layer = text_layer.resize((1920, 1080), Image.LANCZOS)
+    :param rgb: RGB half of the sprite, see timeline.split_sprite
+    :param alpha: Alpha half of the sprite
+    """
+    text_clip = sprite_clip(rgb, alpha)
+    text_clip.canvas_offset = (x, y)
+    return text_clip
 
-    return ImageClip(np.array(text_layer))
+def caption_position(position, offset, scale=None):
+    """
+    Translate a position given for the full caption canvas to a cropped text clip.
 
-def create_text_animation(word_clip, animation='fadein', fade_duration=0.5):
+    :param position: Canvas position tuple, or a function of t returning one
+    :param offset: The clip's canvas_offset
+    :param scale: Optional function of t giving the canvas scale factor
+    :return: Position tuple, or a function of t when the position animates
+    """
+    canvas_width, canvas_height = CAPTION_CANVAS_SIZE
+    video_width, video_height = VIDEO_SIZE
+
+    def resolve(t):
+        x, y = position(t) if callable(position) else position
+        s = scale(t) if scale else 1
+        if isinstance(x, str):
+            x = {'left': 0, 'center': (video_width - canvas_width * s) / 2, 'right': video_width - canvas_width * s}[x]
+        if isinstance(y, str):
+            y = {'top': 0, 'center': (video_height - canvas_height * s) / 2, 'bottom': video_height - canvas_height * s}[y]
+        return x + offset[0] * s, y + offset[1] * s
+
+    if callable(position) or scale:
+        return resolve
+    return resolve(0)
+
+def create_text_animation(word_clip, animation='fadein', fade_duration=0.5, position=('center', 'center')):
+    offset = word_clip.canvas_offset
     if animation == 'fadein':
         return word_clip.fadein(fade_duration)
     elif animation == 'fadeout':
         return word_clip.fadeout(fade_duration)
     elif animation == 'scale':
-        return word_clip.resize(lambda t: 1 + 0.1 * (5 * t))
+        scale = lambda t: 1 + 0.1 * (5 * t)
+        return animate_sprite(word_clip, scale=scale).set_position(caption_position(position, offset, scale))
+    elif animation == 'rotate':
+        return animate_sprite(word_clip, angle=lambda t: 45 * t)
+    elif animation == 'flip':
+        return animate_sprite(word_clip, flip=True)
+    elif animation == 'slide_up':
+        return word_clip.set_position(caption_position(lambda t: ('center', 100 + t * 100), offset))
+    elif animation == 'bounce':
+        return word_clip.set_position(caption_position(lambda t: ('center', bounce_offset(t, fade_duration)[1]), offset))
+    elif animation == 'wave':
+        x, y = caption_position(position, offset)
+        return word_clip.set_position(lambda t: (x + wave_offset(t)[0], y))
     elif animation == 'wiggle':
-        return word_clip.set_position(lambda t: ('center', 840 + np.sin(2 * np.pi * 2 * t) * 5))
+        return word_clip.set_position(caption_position(lambda t: ('center', 840 + np.sin(2 * np.pi * 2 * t) * 5), offset))
     return word_clip
 
+def split_subtitles(subs, words_per_clip, total_duration):
+    """
+    Split subtitles into on-screen word chunks.
+
+    :return: List of (text, start_time, end_time), in subtitle order
+    """
+    chunks = []
+    for sub in subs:
+        start_time = sub.start.ordinal / 1000
+        end_time = min(sub.end.ordinal / 1000, total_duration)
+        duration = end_time - start_time
+        words = sub.text.replace('\n', ' ').split()
+        num_clips = max(1, len(words) // words_per_clip + (1 if len(words) % words_per_clip else 0))
+        clip_duration = duration / num_clips
+
+        for i in range(num_clips):
+            combined_words = ' '.join(words[i * words_per_clip:(i + 1) * words_per_clip])
+            word_start_time = start_time + i * clip_duration
+            word_end_time = min(word_start_time + clip_duration, total_duration)
+            chunks.append((combined_words, word_start_time, word_end_time))
+    return chunks
+
 def create_text_clips_from_subtitles(config):
     """
     Create text clips from subtitles with optimized processing.
@@ -169,7 +260,6 @@ def create_text_clips_from_subtitles(config):
     stroke_width = text_style_config.get('stroke_width', 0)
     stroke_color = text_style_config.get('stroke_color', 'black')
     shadow_opacity = text_style_config.get('shadow_opacity', 0.6)
-    bg_color = text_style_config.get('bg_color', None)
     shadow_color = text_style_config.get('shadow_color', 'black')
     shadow_stroke_width = text_style_config.get('shadow_stroke_width', 20)
     shadow = text_style_config.get('shadow', False)
@@ -179,6 +269,7 @@ def create_text_clips_from_subtitles(config):
     transition_config = config.get('transition_config', {}).get('text', {})
     fade_duration = transition_config.get('duration', 0.5)
     text_animation = transition_config.get('animation', 'fadein')
+    render_config = config.get('render_config', {})
 
     subs = pysrt.open(subtitle_file)
 
@@ -188,87 +279,179 @@ def create_text_clips_from_subtitles(config):
         'center': ('center', 'center')
     }.get(position, ('center', 'center'))
 
-    def process_subtitle(sub):
-        start_time = sub.start.ordinal / 1000
-        end_time = min(sub.end.ordinal / 1000, total_duration)
-        duration = end_time - start_time
-        words = sub.text.replace('\n', ' ').split()
-        num_clips = max(1, len(words) // words_per_clip + (1 if len(words) % words_per_clip else 0))
-        clip_duration = duration / num_clips
-
-        clips = []
-        for i in range(num_clips):
-            combined_words = ' '.join(words[i * words_per_clip:(i + 1) * words_per_clip])
-            word_start_time = start_time + i * clip_duration
-            word_end_time = min(word_start_time + clip_duration, total_duration)
-
-            word_clip = create_high_quality_text_clip(
-                combined_words, font, fontsize, color, stroke_width, stroke_color, bg_color
-            ).set_start(word_start_time).set_duration(word_end_time - word_start_time).set_position(text_position)
-
-            word_clip = create_text_animation(word_clip, text_animation, fade_duration)
-
-            if shadow:
-                shadow_word_clip = create_high_quality_text_clip(
-                    combined_words, font, fontsize, shadow_color, shadow_stroke_width, shadow_color, bg_color
-                ).set_start(word_start_time).set_duration(word_end_time - word_start_time).set_position(text_position).set_opacity(shadow_opacity)
-
-                shadow_word_clip = create_text_animation(shadow_word_clip, text_animation, fade_duration)
-                clips.append(shadow_word_clip)
-
-            clips.append(word_clip)
+    chunks = split_subtitles(subs, words_per_clip, total_duration)
+
+    # The shadow is merged under the text, so every chunk is a single sprite
+    styles = []
+    if shadow:
+        styles.append((shadow_color, shadow_stroke_width, shadow_color, shadow_opacity))
+    styles.append((color, stroke_width, stroke_color, 1.0))
+    jobs = [(combined_words, font, fontsize, styles) for combined_words, _, _ in chunks]
+
+    cache = None
+    if render_config.get('caption_cache', True):
+        cache = shared_caption_cache(
+            max_mb=render_config.get('caption_cache_mb', 256),
+            disk=render_config.get('caption_disk_cache', False),
+            cache_dir=config.get('cache_dir'),
+        )
+    sprites = rasterize_captions(
+        jobs, CAPTION_CANVAS_SIZE,
+        backend=render_config.get('caption_backend', 'thread'),
+        workers=render_config.get('caption_workers'),
+        cache=cache,
+    )
 
-        return clips
+    text_clips = []
+    for (combined_words, word_start_time, word_end_time), sprite in zip(chunks, sprites):
+        word_clip = caption_clip(*sprite)
+        word_clip = word_clip.set_start(word_start_time).set_duration(word_end_time - word_start_time).set_position(
+            caption_position(text_position, word_clip.canvas_offset))
 
-    with ThreadPoolExecutor(max_workers=multiprocessing.cpu_count()) as executor:
-        text_clips = list(executor.map(process_subtitle, subs))
+        word_clip = create_text_animation(word_clip, text_animation, fade_duration, text_position)
+        word_clip.signature = ('caption', combined_words, file_hash(font), fontsize, tuple(styles),
+                               text_animation, fade_duration, text_position)
+        text_clips.append(word_clip)
 
-    return [clip for sublist in text_clips for clip in sublist]
+    return text_clips
 
-def generate_final_video(config):
+def generate_final_video(config, stats=None):
     """
     Generate the final video with optimized processing.
+
+    :param config: Render configuration, see the example below
+    :param stats: Optional RenderStats to fill with per-stage timings
+    :return: The RenderStats of this render
     """
-    video_size = (1080, 1920)  # Adjust to your video's dimensions
+    stats = stats or RenderStats()
+    video_size = VIDEO_SIZE  # Adjust to your video's dimensions
 
-    audio_clip = AudioFileClip(config['background_audio'])
-    audio_len = audio_clip.duration
+    audio_len = ffmpeg_parse_infos(config['background_audio'])['duration']
     num_images = len(config['background_images'])
     constant_image_duration = audio_len / num_images
 
     config['image_durations'] = [constant_image_duration] * num_images
     config['total_duration'] = audio_len
 
-    background_clips, swoosh_audio_clips = create_background_image_sequence(config)
-    text_clips = create_text_clips_from_subtitles(config)
+    with stats.stage('backgrounds'):
+        background_clips, swoosh_tracks = create_background_image_sequence(config)
+    with stats.stage('captions'):
+        text_clips = create_text_clips_from_subtitles(config)
 
     # Create watermark
-    watermark = create_svg_watermark(
-        config['watermark_svg'],
-        video_size=video_size,
-        watermark_size=(500, 100),  # Adjust size as needed
-    )
-    watermark = watermark.set_duration(audio_len)
-
-    main_video = CompositeVideoClip(
+    with stats.stage('watermark'):
+        watermark = create_svg_watermark(
+            config['watermark_svg'],
+            video_size=video_size,
+            watermark_size=(500, 100),  # Adjust size as needed
+            cache_dir=config.get('cache_dir'),
+        )
+        watermark = watermark.set_duration(audio_len)
+        watermark.signature = ('watermark', file_hash(config['watermark_svg']), (500, 100))
+
+    main_video = IndexedCompositeVideoClip(
         background_clips + text_clips + [watermark],
         size=video_size
     ).set_duration(audio_len)
 
-    final_audio = CompositeAudioClip([audio_clip] + swoosh_audio_clips)
-    final_clip = main_video.set_audio(final_audio)
-
+    fps = 30
     output_filename = config.get('output_filename', 'output_video.mp4')
-    final_clip.write_videofile(
-        output_filename,
-        codec="libx264",
-        audio_codec="aac",
-        threads=multiprocessing.cpu_count(),
-        preset='faster',
-        fps=30
-    )
+    render_config = config.get('render_config', {})
+
+    # Mixed offline into one buffer; the music is decoded for this render only
+    with stats.stage('audio'):
+        music = Track(config['background_audio'], role='music', cache=False)
+        mixed = mix_tracks([music] + swoosh_tracks, audio_len,
+                           duck=render_config.get('duck_music'),
+                           ceiling=render_config.get('audio_limiter'))
+    final_clip = main_video.set_audio(sample_clip(mixed))
+
+    stats.count('frames', count_frames(audio_len, fps))
+    stats.count('clips', len(main_video.clips))
+    # 'yuv420p' converts frames in-process and halves the bytes piped to ffmpeg
+    pipe_format = render_config.get('pipe_format', 'rgb24')
+    if render_config.get('incremental'):
+        with stats.stage('encoding'):
+            rendered, reused, frame_cache_hits = write_incremental(
+                final_clip,
+                output_filename,
+                fps=fps,
+                settings=(video_size,),
+                codec="libx264",
+                audio_codec="aac",
+                preset='faster',
+                workers=render_config.get('segments'),
+                segment_seconds=render_config.get('segment_seconds', 2.0),
+                pix_fmt=pipe_format,
+            )
+        stats.count('segments_rendered', rendered)
+        stats.count('segments_reused', reused)
+        stats.count('frame_cache_hits', frame_cache_hits)
+    elif render_config.get('segments'):
+        # Frames are composited inside the segment workers, so only the total is
+        # timed and the per-frame profile is not available
+        with stats.stage('encoding'):
+            frame_cache_hits = write_segmented(
+                final_clip,
+                output_filename,
+                fps=fps,
+                codec="libx264",
+                audio_codec="aac",
+                preset='faster',
+                workers=render_config['segments'],
+                gop=render_config.get('gop'),
+                pix_fmt=pipe_format,
+            )
+        # Summed over the segment workers, which each keep their own copy of the memo
+        stats.count('frame_cache_hits', frame_cache_hits)
+    else:
+        profiler = FrameProfiler() if render_config.get('profile') else None
+        if profiler is not None:
+            profiler.instrument(final_clip)
+        stats.timed_frames(final_clip, 'compositing')
+        output_dir = os.path.dirname(os.path.abspath(output_filename))
+        with tempfile.TemporaryDirectory(prefix='audio_', dir=output_dir) as work_dir:
+            audiofile = os.path.join(work_dir, 'audio.m4a')
+            with stats.stage('audio'):
+                write_clip_audio(final_clip.audio, audiofile, AUDIO_FPS, codec="aac")
+            start = time.perf_counter()
+            queue_size = render_config.get('writer_queue', 4)
+            with profiler.profile_writer() if profiler is not None else contextlib.nullcontext():
+                if queue_size:
+                    # Frames are composited while a writer thread pipes earlier ones to ffmpeg
+                    write_clip(
+                        final_clip,
+                        output_filename,
+                        fps=fps,
+                        codec="libx264",
+                        preset='faster',
+                        threads=multiprocessing.cpu_count(),
+                        audiofile=audiofile,
+                        queue_size=queue_size,
+                        pix_fmt=pipe_format,
+                        stats=stats,
+                    )
+                else:
+                    final_clip.write_videofile(
+                        output_filename,
+                        codec="libx264",
+                        audio=audiofile,
+                        threads=multiprocessing.cpu_count(),
+                        preset='faster',
+                        fps=fps
+                    )
+                    # Frames are composited and encoded in turn, so encoding is what compositing leaves
+                    stats.add_time('encoding', time.perf_counter() - start - stats.stages.get('compositing', 0.0))
+        # Frames that repeated the previous composite instead of blending it again
+        stats.count('frame_cache_hits', main_video.memo.hits)
+
+        if profiler is not None:
+            profiler.write_trace(render_config['profile'])
+            profiler.print_summary()
+            print(f"Frame trace written to {render_config['profile']}")
 
     print(f"Video creation complete. Output file: {output_filename}")
+    return stats
 
 if __name__ == "__main__":
     # Configuration
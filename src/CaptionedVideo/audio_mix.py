@@ -0,0 +1,217 @@
+"""
+Decoded audio shared across the timeline, and the offline mix.
+
+Every AudioFileClip starts its own ffmpeg reader, so a reel with ten slide
+transitions used to decode the same swoosh file ten times in ten
+subprocesses. decode_audio has ffmpeg decode a file once per process
+straight to a float32 sample array, and sound_clip places it on the timeline as a clip reading
+from that shared buffer.
+
+CompositeAudioClip mixes its clips while the file is written, chunk by
+chunk, calling every clip of the mix for every chunk. mix_tracks instead
+adds each decoded source into one preallocated buffer at its sample
+offset, with optional ducking of the music under the effects and a peak
+limiter, and write_audio pipes that buffer to ffmpeg as one PCM stream.
+"""
+import os
+import subprocess as sp
+import threading
+
+import numpy as np
+from moviepy.audio.AudioClip import AudioClip
+from moviepy.config import get_setting
+
+AUDIO_FPS = 44100
+
+_decoded = {}
+_decode_lock = threading.Lock()
+
+
+def _ffmpeg_decode(path, fps, channels=2):
+    # Stereo like AudioFileClip, but as float samples in one read
+    cmd = [get_setting("FFMPEG_BINARY"), '-loglevel', 'error', '-i', path, '-vn',
+           '-f', 'f32le', '-acodec', 'pcm_f32le', '-ar', str(fps), '-ac', str(channels), '-']
+    proc = sp.run(cmd, stdout=sp.PIPE, stderr=sp.PIPE)
+    if proc.returncode:
+        raise IOError(f"Decoding {path} failed:\n{proc.stderr.decode(errors='replace')}")
+    return np.frombuffer(proc.stdout, np.float32).reshape(-1, channels).copy()
+
+
+def decode_audio(path, fps=AUDIO_FPS, cache=True):
+    """
+    Decode an audio file to a read-only (samples, channels) float32 array, once per process.
+
+    :param cache: Keep the samples for later calls; off for long files used
+                  once, such as the music of a reel
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size, fps)
+    with _decode_lock:
+        samples = _decoded.get(key)
+        if samples is None:
+            samples = _ffmpeg_decode(path, fps)
+            samples.setflags(write=False)
+            if cache:
+                _decoded[key] = samples
+    return samples
+
+
+def sample_clip(samples, fps=AUDIO_FPS):
+    """
+    Audio clip reading from a sample array without copying it.
+
+    Times map to the nearest sample, as the ffmpeg reader does; AudioArrayClip
+    truncates, which puts some samples one position off.
+    """
+    def make_frame(t):
+        index = np.round(fps * np.asarray(t)).astype(int)
+        inside = (index >= 0) & (index < len(samples))
+        frame = np.zeros(index.shape + samples.shape[1:], np.float32)
+        frame[inside] = samples[index[inside]]
+        return frame
+
+    clip = AudioClip(make_frame, duration=len(samples) / fps, fps=fps)
+    clip.samples = samples
+    return clip
+
+
+def sound_clip(path, start=0, duration=None, fps=AUDIO_FPS):
+    """
+    Audio clip of a decoded file placed at `start`, sharing the decoded samples.
+
+    :param duration: Cut the sound after this many seconds; past the end of
+                     the file the clip is silent, like a longer set_duration
+    """
+    samples = decode_audio(path, fps)
+    if duration is not None:
+        samples = samples[:int(round(duration * fps))]
+    clip = sample_clip(samples, fps).set_start(start)
+    if duration is not None:
+        clip = clip.set_duration(duration)
+    return clip
+
+
+class Track:
+    """
+    One source of the offline mix.
+
+    :param path: Audio file
+    :param start: Where the sound starts on the timeline, in seconds
+    :param duration: Cut the sound after this many seconds
+    :param gain: Linear gain
+    :param role: 'music' tracks are ducked under 'effect' tracks
+    :param cache: Keep the decoded samples for later renders in this process
+    """
+
+    def __init__(self, path, start=0, duration=None, gain=1.0, role='effect', cache=True):
+        self.path = path
+        self.start = start
+        self.duration = duration
+        self.gain = gain
+        self.role = role
+        self.cache = cache
+
+
+def duck_envelope(tracks, length, fps, gain, ramp=0.05):
+    """
+    Gain envelope for the music: `gain` while an effect plays, 1 elsewhere,
+    with linear ramps of `ramp` seconds.
+    """
+    envelope = np.ones(length, np.float32)
+    for track in tracks:
+        if track.role != 'effect':
+            continue
+        first = max(0, int(round(track.start * fps)))
+        end = length if track.duration is None else int(round((track.start + track.duration) * fps))
+        envelope[first:max(first, min(length, end))] = gain
+
+    width = int(ramp * fps)
+    if width > 1:
+        # Moving average of the step envelope turns every edge into a ramp
+        padded = np.concatenate([np.full(width // 2, envelope[0]), envelope,
+                                 np.full(width - width // 2, envelope[-1])])
+        cumsum = np.concatenate([[0.0], np.cumsum(padded, dtype=np.float64)])
+        envelope = ((cumsum[width:width + length] - cumsum[:length]) / width).astype(np.float32)
+    return envelope
+
+
+def limit(samples, ceiling=0.98, block=256):
+    """
+    Keep the peaks of `samples` under `ceiling`, in place.
+
+    The gain of every block of `block` samples is low enough for its own
+    peak and those of its neighbours, and is interpolated between block
+    centers, so the gain falls before a peak and recovers after it
+    without steps.
+    """
+    length = len(samples)
+    blocks = -(-length // block)
+    peaks = np.zeros(blocks * block, np.float32)
+    peaks[:length] = np.abs(samples).max(axis=1)
+    peaks = peaks.reshape(blocks, block).max(axis=1)
+    gains = np.minimum(1.0, ceiling / np.maximum(peaks, 1e-9))
+    if gains.min() >= 1.0:
+        return samples
+
+    padded = np.concatenate([gains[:1], gains, gains[-1:]])
+    gains = np.minimum(np.minimum(padded[:-2], padded[1:-1]), padded[2:])
+    centers = np.arange(blocks) * block + block / 2
+    samples *= np.interp(np.arange(length), centers, gains).astype(np.float32)[:, None]
+    np.clip(samples, -ceiling, ceiling, out=samples)
+    return samples
+
+
+def mix_tracks(tracks, duration, fps=AUDIO_FPS, duck=None, ceiling=None):
+    """
+    Mix tracks into one (samples, channels) float32 buffer.
+
+    :param duration: Length of the mix in seconds; sounds are cut at the end
+    :param duck: Gain of the music while an effect plays, or None to not duck
+    :param ceiling: Peak level of the limiter, or None to leave the mix as it
+                    is; ffmpeg then clips overs, as with CompositeAudioClip
+    """
+    sources = [decode_audio(track.path, fps, track.cache) for track in tracks]
+    channels = max((samples.shape[1] for samples in sources), default=2)
+    length = int(round(duration * fps))
+    mixed = np.zeros((length, channels), np.float32)
+    envelope = duck_envelope(tracks, length, fps, duck) if duck is not None else None
+
+    for track, samples in zip(tracks, sources):
+        if track.duration is not None:
+            samples = samples[:int(round(track.duration * fps))]
+        offset = int(round(track.start * fps))
+        first = max(0, -offset)
+        end = min(len(samples), length - offset)
+        if first >= end:
+            continue
+        gain = track.gain
+        if envelope is not None and track.role == 'music':
+            gain = gain * envelope[offset + first:offset + end, None]
+        mixed[offset + first:offset + end] += samples[first:end] * gain
+
+    if ceiling is not None:
+        limit(mixed, ceiling)
+    return mixed
+
+
+def write_audio(samples, path, fps=AUDIO_FPS, codec='aac'):
+    """
+    Encode a (samples, channels) float32 buffer to `path` in one ffmpeg call.
+    """
+    cmd = [get_setting("FFMPEG_BINARY"), '-y', '-loglevel', 'error',
+           '-f', 'f32le', '-ar', str(fps), '-ac', str(samples.shape[1]), '-i', '-',
+           '-acodec', codec, path]
+    proc = sp.run(cmd, input=np.ascontiguousarray(samples, np.float32).tobytes(), stdout=sp.DEVNULL, stderr=sp.PIPE)
+    if proc.returncode:
+        raise IOError(f"Writing the audio of {path} failed:\n{proc.stderr.decode(errors='replace')}")
+
+
+def write_clip_audio(audio, path, fps=AUDIO_FPS, codec='aac'):
+    """
+    Encode an audio clip to `path`, in one PCM stream if it is a mixed sample buffer.
+    """
+    samples = getattr(audio, 'samples', None)
+    if samples is not None and getattr(audio, 'fps', None) == fps and audio.start == 0:
+        write_audio(samples[:int(round(audio.duration * fps))], path, fps, codec)
+    else:
+        audio.write_audiofile(path, fps=fps, codec=codec, logger=None)
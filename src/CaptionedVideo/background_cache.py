@@ -0,0 +1,87 @@
+"""
+Persistent cache of decoded, pre-resized background images.
+
+The same stock images come back in many reels, and every render used to
+decode the PNG and resample it to the video height again. Resized frames are
+stored as raw .npy arrays keyed by the image content hash, the target height
+and the resample filter, and are memory-mapped on later renders.
+"""
+import hashlib
+import os
+
+import numpy as np
+from PIL import Image
+
+CACHE_DIR = os.environ.get('SHORTGEN_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'shortgen'))
+
+RESAMPLE_NAMES = {
+    Image.NEAREST: 'nearest',
+    Image.BILINEAR: 'bilinear',
+    Image.BICUBIC: 'bicubic',
+    Image.LANCZOS: 'lanczos',
+}
+
+_hashes = {}
+
+
+def get_cache_dir(name, cache_dir=None):
+    """
+    Return (and create) the directory for one kind of cached data.
+    """
+    path = os.path.join(cache_dir or CACHE_DIR, name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def file_hash(path):
+    """
+    SHA-256 of a file's content, remembered while the file stays unchanged.
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    digest = _hashes.get(key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        digest = _hashes[key] = sha.hexdigest()
+    return digest
+
+
+def save_array(path, array):
+    """
+    Write an array to an .npy file atomically, so concurrent renders never read a partial file.
+    """
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def load_resized_image(image_path, height, resample=Image.LANCZOS, cache_dir=None):
+    """
+    Load an image resized to `height`, keeping its aspect ratio.
+
+    The result matches ImageClip(image_path).resize(height=height): an RGB or
+    RGBA uint8 array whose width is int(width * height / original_height).
+
+    :param image_path: Path to the source image
+    :param height: Target height in pixels
+    :param resample: PIL resample filter
+    :param cache_dir: Root of the cache, defaults to CACHE_DIR
+    :return: Read-only memory-mapped numpy array
+    """
+    resample_name = RESAMPLE_NAMES.get(resample, str(resample))
+    key = f'{file_hash(image_path)}_h{height}_{resample_name}.npy'
+    cached_path = os.path.join(get_cache_dir('backgrounds', cache_dir), key)
+
+    if not os.path.exists(cached_path):
+        with Image.open(image_path) as image:
+            has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+            width = int(image.width * height / image.height)
+            resized = np.asarray(image.resize((width, height), resample))
+        save_array(cached_path, resized)
+
+    return np.load(cached_path, mmap_mode='r')
@@ -0,0 +1,201 @@
+"""
+Batch renderer for many reels.
+
+Takes a directory of JSON configs (or a JSON manifest listing config files)
+and renders them with UpdateOptimized.generate_final_video in a bounded pool
+of long-lived worker processes. Each worker keeps its fonts, glyph atlases
+and caption sprites warm from one job to the next, and every worker shares
+the on-disk background and caption caches.
+
+Every job writes <name>.status.json in the batch status directory, where
+<name> is the config's path relative to the directory or manifest, with
+'__' between path components. A crashed or interrupted batch picks up
+where it stopped:
+
+    python batch.py configs/ --workers 2
+    python batch.py batch.json --status-dir runs/today --force
+
+Paths in a config are relative to the config file.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Config entries holding file paths, as (section, key) pairs
+PATH_KEYS = [
+    (None, 'subtitle_file'),
+    (None, 'background_audio'),
+    (None, 'watermark_svg'),
+    (None, 'output_filename'),
+    (None, 'cache_dir'),
+    ('text_style_config', 'font'),
+]
+
+
+def batch_root(source):
+    """
+    Directory the config paths of a batch are relative to: the directory
+    itself, or the one holding the manifest.
+    """
+    if os.path.isdir(source):
+        return source
+    return os.path.dirname(os.path.abspath(source))
+
+
+def find_configs(source):
+    """
+    List the config files of a batch: every .json file of a directory, or
+    the files named in a JSON manifest (a list of paths, relative to it).
+    """
+    if os.path.isdir(source):
+        return sorted(os.path.join(source, name) for name in os.listdir(source) if name.endswith('.json'))
+    with open(source) as f:
+        entries = json.load(f)
+    base = batch_root(source)
+    return [os.path.join(base, entry) for entry in entries]
+
+
+def status_name(config_path, root):
+    """
+    Name of a config's status file, unique among the configs under `root`.
+    """
+    name = os.path.splitext(os.path.relpath(os.path.abspath(config_path), os.path.abspath(root)))[0]
+    return name.replace(os.sep, '__')
+
+
+def load_config(path):
+    """
+    Load a config file and make its paths absolute.
+    """
+    with open(path) as f:
+        config = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    resolve = lambda p: p if os.path.isabs(p) else os.path.join(base, p)
+
+    for section, key in PATH_KEYS:
+        values = config.get(section, {}) if section else config
+        if values.get(key):
+            values[key] = resolve(values[key])
+    config['background_images'] = [resolve(p) for p in config.get('background_images', [])]
+    image_transition = config.get('transition_config', {}).get('image', {})
+    if image_transition.get('sound_path'):
+        image_transition['sound_path'] = resolve(image_transition['sound_path'])
+    config.setdefault('output_filename', os.path.splitext(os.path.abspath(path))[0] + '.mp4')
+    return config
+
+
+def read_status(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_status(path, status):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(status, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def run_job(config_path, status_path, render_config):
+    """
+    Render one config in a worker process, recording its progress in `status_path`.
+    """
+    from UpdateOptimized import generate_final_video
+
+    status = {'config': config_path, 'state': 'running', 'pid': os.getpid(), 'started': time.time()}
+    write_status(status_path, status)
+    try:
+        config = load_config(config_path)
+        config['render_config'] = dict(render_config, **config.get('render_config', {}))
+        stats = generate_final_video(config)
+        status.update(state='done', output=config['output_filename'], stats=stats.as_dict())
+    except Exception as e:
+        status.update(state='failed', error=repr(e), traceback=traceback.format_exc())
+    status['finished'] = time.time()
+    write_status(status_path, status)
+    return status
+
+
+def run_batch(config_paths, status_dir, workers=1, force=False, render_config=None, root=None):
+    """
+    Render every config that has not finished yet.
+
+    :param root: Directory status names are relative to, see batch_root;
+                 defaults to the common directory of the configs
+    :return: List of the job statuses of this run
+    """
+    if root is None and config_paths:
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in config_paths])
+    os.makedirs(status_dir, exist_ok=True)
+    # Sprites go to disk so every worker, and the next batch, can reuse them
+    render_config = dict({'caption_disk_cache': True}, **(render_config or {}))
+
+    jobs = []
+    for path in config_paths:
+        name = status_name(path, root)
+        status_path = os.path.join(status_dir, f'{name}.status.json')
+        status = read_status(status_path)
+        if not force and status.get('state') == 'done' and os.path.exists(status.get('output', '')):
+            print(f"Skipping {name}: already rendered")
+            continue
+        jobs.append((path, status_path))
+
+    print(f"Rendering {len(jobs)} of {len(config_paths)} reels with {workers} workers")
+    start = time.time()
+    results = []
+    method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method)) as executor:
+        futures = {executor.submit(run_job, path, status_path, render_config): (path, status_path)
+                   for path, status_path in jobs}
+        for future in as_completed(futures):
+            try:
+                status = future.result()
+            except Exception as e:
+                # The worker died (killed or crashed); once the pool is broken
+                # every job still queued or running ends up here as well
+                path, status_path = futures[future]
+                status = {'config': path, 'state': 'failed', 'error': repr(e), 'finished': time.time()}
+                write_status(status_path, status)
+            results.append(status)
+            print(f"[{len(results)}/{len(jobs)}] {status['state']}: {status['config']}")
+
+    wall = time.time() - start
+    done = [s for s in results if s['state'] == 'done']
+    frames = sum(s['stats']['counters'].get('frames', 0) for s in done)
+    summary = {
+        'jobs': len(jobs),
+        'done': len(done),
+        'failed': len(results) - len(done),
+        'wall_s': wall,
+        'reels_per_hour': len(done) / wall * 3600 if wall else 0.0,
+        'frames_per_s': frames / wall if wall else 0.0,
+    }
+    write_status(os.path.join(status_dir, 'batch.json'), summary)
+    print(json.dumps(summary))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='Directory of JSON configs, or a JSON list of config paths')
+    parser.add_argument('--workers', type=int, default=1, help='Reels rendered at the same time')
+    parser.add_argument('--status-dir', help='Where job status files go, defaults to <source>.status')
+    parser.add_argument('--force', action='store_true', help='Render finished jobs again')
+    parser.add_argument('--render-config', default='{}', help="JSON defaults for config['render_config']")
+    args = parser.parse_args()
+
+    status_dir = args.status_dir or os.path.normpath(args.source).rsplit('.json', 1)[0] + '.status'
+    results = run_batch(find_configs(args.source), status_dir, args.workers, args.force,
+                        json.loads(args.render_config), batch_root(args.source))
+    if any(s['state'] != 'done' for s in results):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Render benchmark for UpdateOptimized.generate_final_video.
+
+Generates synthetic subtitles, background images, audio and a watermark,
+renders configs of increasing size and prints one JSON object per config
+with wall time, frames per second, peak memory and per-stage times.
+
+Each config runs in a fresh process so peak RSS is measured per render:
+
+    python benchmark.py --font Fonts/Bangers.ttf --sizes small medium
+    python benchmark.py --font Fonts/Bangers.ttf --output results.jsonl --render-config '{"segments": 4}'
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import wave
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+# name: (audio duration in seconds, number of background images)
+SIZES = {
+    'small': (5, 2),
+    'medium': (15, 5),
+    'large': (60, 12),
+}
+
+WORDS = ('the quick brown fox jumps over a lazy dog while every small wave '
+         'keeps rolling toward THE BIG shore AND nobody knows why').split()
+
+SAMPLE_RATE = 44100
+
+
+def write_wav(path, samples):
+    """
+    Write float samples in [-1, 1] as a 16-bit stereo WAV file.
+    """
+    pcm = (np.clip(samples, -1, 1) * 32767).astype('<i2')
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(np.repeat(pcm[:, None], 2, axis=1).tobytes())
+
+
+def make_audio(path, duration):
+    t = np.arange(int(duration * SAMPLE_RATE)) / SAMPLE_RATE
+    write_wav(path, 0.2 * np.sin(2 * np.pi * 220 * t) + 0.1 * np.sin(2 * np.pi * 330 * t))
+
+
+def make_swoosh(path, duration=0.4, seed=0):
+    n = int(duration * SAMPLE_RATE)
+    noise = np.random.default_rng(seed).uniform(-1, 1, n)
+    write_wav(path, 0.3 * noise * np.hanning(n))
+
+
+def make_image(path, index, size=(1440, 1920)):
+    """
+    Write a smooth gradient image with a few shapes, distinct per index.
+    """
+    width, height = size
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    phase = index * 0.7
+    r = 127 + 127 * np.sin(x / width * np.pi * 2 + phase)
+    g = 127 + 127 * np.sin(y / height * np.pi * 2 + phase * 1.3)
+    b = 127 + 127 * np.cos((x + y) / (width + height) * np.pi * 4 + phase)
+    image = np.stack([r, g, b], axis=-1)
+    for k in range(3):
+        cx, cy = width * (0.2 + 0.3 * k), height * (0.3 + 0.2 * ((k + index) % 3))
+        inside = ((x - cx) / (width * 0.12)) ** 2 + ((y - cy) / (height * 0.08)) ** 2 < 1
+        image[inside] = 255 - image[inside]
+    Image.fromarray(image.astype(np.uint8)).save(path)
+
+
+def srt_time(seconds):
+    ms = int(round(seconds * 1000))
+    return f'{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d},{ms % 1000:03d}'
+
+
+def make_subtitles(path, duration, seed=0):
+    """
+    Write an SRT with a subtitle of three to eight words every 0.8 to 2 seconds.
+    """
+    rng = random.Random(seed)
+    entries = []
+    start = 0.0
+    while start < duration - 0.3:
+        end = min(duration, start + rng.uniform(0.8, 2.0))
+        text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 8)))
+        entries.append(f'{len(entries) + 1}\n{srt_time(start)} --> {srt_time(end)}\n{text}\n')
+        start = end
+    with open(path, 'w') as f:
+        f.write('\n'.join(entries))
+
+
+def make_watermark(path):
+    with open(path, 'w') as f:
+        f.write('<svg xmlns="http://www.w3.org/2000/svg" width="500" height="100">'
+                '<rect x="5" y="5" width="490" height="90" rx="20" fill="#000" fill-opacity="0.4"/>'
+                '<circle cx="50" cy="50" r="30" fill="#ffcc00"/></svg>')
+
+
+def make_config(name, directory, font):
+    """
+    Generate the assets of one benchmark size into `directory` and return its render config.
+    """
+    duration, num_images = SIZES[name]
+    os.makedirs(directory, exist_ok=True)
+    audio = os.path.join(directory, 'background.wav')
+    swoosh = os.path.join(directory, 'swoosh.wav')
+    subtitles = os.path.join(directory, 'subtitle.srt')
+    watermark = os.path.join(directory, 'watermark.svg')
+    images = [os.path.join(directory, f'{i + 1}.png') for i in range(num_images)]
+
+    make_audio(audio, duration)
+    make_swoosh(swoosh)
+    make_subtitles(subtitles, duration)
+    make_watermark(watermark)
+    for i, image in enumerate(images):
+        make_image(image, i)
+
+    return {
+        'background_images': images,
+        'subtitle_file': subtitles,
+        'background_audio': audio,
+        'words_per_clip': 2,
+        'output_filename': os.path.join(directory, 'output.mp4'),
+        'cache_dir': os.path.join(directory, 'cache'),
+        'text_style_config': {
+            'color': '#9bc063',
+            'fontSize': 180,
+            'stroke_width': 10,
+            'shadow': True,
+            'stroke_color': 'black',
+            'shadow_opacity': 0.9,
+            'shadow_color': '#FFFFFF',
+            'shadow_stroke_width': 20,
+            'bg_color': None,
+            'font': font,
+            'position': 'center'
+        },
+        'transition_config': {
+            'image': {
+                'duration': 0.25,
+                'animations': ['slide_up', 'fade', 'scale'],
+                'sound_path': swoosh,
+                'max_scale': 1.2
+            },
+            'text': {
+                'duration': 0.25,
+                'animation': 'wiggle',
+            }
+        },
+        'watermark_svg': watermark,
+    }
+
+
+def run_benchmark(name, directory, font, render_config):
+    """
+    Render one benchmark size and return its statistics.
+    """
+    from UpdateOptimized import generate_final_video
+
+    config = make_config(name, directory, font)
+    config['render_config'] = render_config
+    stats = generate_final_video(config)
+    result = {'config': name, 'duration_s': SIZES[name][0], 'images': SIZES[name][1]}
+    result.update(stats.as_dict())
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--font', default='Fonts/Bangers.ttf', help='TrueType font used for the captions')
+    parser.add_argument('--sizes', nargs='+', default=list(SIZES), choices=list(SIZES))
+    parser.add_argument('--render-config', default='{}', help="JSON passed as config['render_config']")
+    parser.add_argument('--output', help='Append results to this JSON-lines file')
+    parser.add_argument('--keep', action='store_true', help='Keep the generated assets and videos')
+    args = parser.parse_args()
+
+    font = os.path.abspath(args.font)
+    render_config = json.loads(args.render_config)
+    root = tempfile.mkdtemp(prefix='shortgen_bench_')
+    context = multiprocessing.get_context('spawn')
+    try:
+        for name in args.sizes:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(run_benchmark, name, os.path.join(root, name), font, render_config).result()
+            result['render_config'] = render_config
+            line = json.dumps(result)
+            print(line)
+            if args.output:
+                with open(args.output, 'a') as f:
+                    f.write(line + '\n')
+    finally:
+        if args.keep:
+            print(f"Benchmark files kept in {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
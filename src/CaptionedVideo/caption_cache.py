@@ -0,0 +1,130 @@
+"""
+Memoized caption sprites.
+
+Scripts repeat short chunks such as "THE" or "AND THEN" many times, and reels
+made in the same theme share most of their style. Rendered sprites are kept
+in an LRU cache with a memory budget, keyed by the text, the font file's
+content hash, the size, the styles and the canvas. An optional disk tier
+stores sprites as .npz files so later renders, in this process or another,
+can reuse them.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from background_cache import file_hash, get_cache_dir
+from timeline import split_sprite
+
+# Bump when the caption renderer changes its output, to invalidate disk entries
+CACHE_VERSION = 1
+
+_shared = None
+
+
+class CaptionCache:
+    """
+    LRU cache of rendered caption sprites, stored as (x, y, rgb, alpha).
+
+    Sprites are kept split the way timeline.sprite_clip draws them, so every
+    clip built from one entry holds the same read-only rgb and alpha arrays.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, cache_dir=None):
+        """
+        :param max_bytes: Memory budget for the in-memory tier
+        :param cache_dir: Directory of the disk tier, or None to keep sprites in memory only
+        """
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(text, font_path, font_size, styles, canvas_size):
+        """
+        Cache key of a caption job, independent of where the font file lives.
+        """
+        styles = tuple(tuple(style) for style in styles)
+        return (text, file_hash(font_path), font_size, styles, tuple(canvas_size))
+
+    def _disk_path(self, key):
+        digest = hashlib.sha256(repr((CACHE_VERSION, key)).encode()).hexdigest()
+        return os.path.join(self.cache_dir, f'{digest}.npz')
+
+    def get(self, key):
+        """
+        Return the cached (x, y, rgb, alpha) for `key`, or None.
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        if self.cache_dir is not None:
+            path = self._disk_path(key)
+            if os.path.exists(path):
+                with np.load(path) as data:
+                    x, y = data['offset']
+                    entry = (int(x), int(y), *split_sprite(data['rgba']))
+                self.disk_hits += 1
+                self._remember(key, entry)
+                return entry
+
+        self.misses += 1
+        return None
+
+    def put(self, key, entry):
+        """
+        Store a rendered (x, y, rgba), in memory and on disk when the disk tier is on.
+
+        :return: The stored (x, y, rgb, alpha)
+        """
+        x, y, rgba = entry
+        if self.cache_dir is not None:
+            path = self._disk_path(key)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, offset=np.array((x, y)), rgba=rgba)
+            os.replace(tmp_path, path)
+        return self._remember(key, (x, y, *split_sprite(rgba)))
+
+    def _remember(self, key, entry):
+        nbytes = entry[2].nbytes + entry[3].nbytes
+        with self._lock:
+            if key not in self.entries and nbytes <= self.max_bytes:
+                self.entries[key] = entry
+                self.nbytes += nbytes
+                self._evict()
+        return entry
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes:
+            _, (_, _, rgb, alpha) = self.entries.popitem(last=False)
+            self.nbytes -= rgb.nbytes + alpha.nbytes
+
+
+def shared_cache(max_mb=256, disk=False, cache_dir=None):
+    """
+    Return the caption cache shared by every render in this process.
+
+    :param max_mb: Memory budget in megabytes; updates the budget of an existing cache
+    :param disk: Whether to also keep sprites on disk
+    :param cache_dir: Root of the disk cache, defaults to background_cache.CACHE_DIR
+    """
+    global _shared
+    disk_dir = get_cache_dir('captions', cache_dir) if disk else None
+    if _shared is None or _shared.cache_dir != disk_dir:
+        _shared = CaptionCache(max_mb * 1024 * 1024, disk_dir)
+    with _shared._lock:
+        _shared.max_bytes = max_mb * 1024 * 1024
+        _shared._evict()
+    return _shared
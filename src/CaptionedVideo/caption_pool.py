@@ -0,0 +1,110 @@
+"""
+Parallel caption rasterization.
+
+Captions are drawn with PIL and plain Python loops, so a thread pool spends
+most of its time waiting on the GIL. With the 'process' backend, batches of
+captions are rendered in worker processes. Each batch of bitmaps comes back
+through one shared memory block rather than as pickled arrays. Results are
+always returned in job order.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from text_engine import render_styled_caption
+from timeline import split_sprite
+
+BATCHES_PER_WORKER = 4
+
+
+def _render_batch(args):
+    """
+    Render a batch of caption jobs into a single shared memory block.
+
+    :return: Tuple of (block name, [(x, y, offset, shape), ...])
+    """
+    canvas_size, jobs = args
+    rendered = [render_styled_caption(*job, canvas_size=canvas_size) for job in jobs]
+
+    layout = []
+    offset = 0
+    for x, y, sprite in rendered:
+        layout.append((x, y, offset, sprite.shape))
+        offset += sprite.nbytes
+
+    block = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    # The parent unlinks the block once it has copied the sprites out
+    resource_tracker.unregister(block._name, 'shared_memory')
+    for (x, y, start, shape), (_, _, sprite) in zip(layout, rendered):
+        np.ndarray(shape, np.uint8, buffer=block.buf, offset=start)[...] = sprite
+    block.close()
+    return block.name, layout
+
+
+def _collect_batch(name, layout):
+    """
+    Copy the sprites out of a worker's shared memory block and release it.
+    """
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return [(x, y, np.ndarray(shape, np.uint8, buffer=block.buf, offset=start).copy())
+                for x, y, start, shape in layout]
+    finally:
+        block.close()
+        block.unlink()
+
+
+def rasterize_captions(jobs, canvas_size, backend='thread', workers=None, cache=None):
+    """
+    Render caption jobs in parallel.
+
+    :param jobs: List of (text, font_path, font_size, styles), see render_styled_caption
+    :param canvas_size: Canvas the captions are laid out on
+    :param backend: 'thread' or 'process'
+    :param workers: Number of workers, defaults to the CPU count
+    :param cache: Optional CaptionCache; only jobs missing from it are rendered,
+                  and each distinct job is rendered once
+    :return: List of (x, y, rgb, alpha) in the same order as `jobs`, see
+             timeline.split_sprite; jobs served by the cache share its arrays
+    """
+    if cache is None:
+        return [(x, y, *split_sprite(rgba)) for x, y, rgba in _rasterize(jobs, canvas_size, backend, workers)]
+
+    keys = [cache.key(*job, canvas_size) for job in jobs]
+    found = {}
+    missing = {}
+    for key, job in zip(keys, jobs):
+        if key not in found and key not in missing:
+            entry = cache.get(key)
+            if entry is None:
+                missing[key] = job
+            else:
+                found[key] = entry
+
+    rendered = _rasterize(list(missing.values()), canvas_size, backend, workers)
+    for key, entry in zip(missing, rendered):
+        found[key] = cache.put(key, entry)
+    return [found[key] for key in keys]
+
+
+def _rasterize(jobs, canvas_size, backend, workers):
+    workers = workers or multiprocessing.cpu_count()
+
+    if backend == 'thread':
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda job: render_styled_caption(*job, canvas_size=canvas_size), jobs))
+    if backend != 'process':
+        raise ValueError(f"Unknown caption backend '{backend}'")
+    if not jobs:
+        return []
+
+    batch_size = max(1, -(-len(jobs) // (workers * BATCHES_PER_WORKER)))
+    batches = [(canvas_size, jobs[i:i + batch_size]) for i in range(0, len(jobs), batch_size)]
+
+    sprites = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for name, layout in executor.map(_render_batch, batches):
+            sprites.extend(_collect_batch(name, layout))
+    return sprites
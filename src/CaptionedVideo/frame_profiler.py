@@ -0,0 +1,125 @@
+"""
+Opt-in per-frame profiling of the composite pipeline.
+
+FrameProfiler wraps the frame, mask and position functions of every layer
+of a composite clip, the composite frame itself, and the ffmpeg writer's
+write_frame. Every call becomes a timed event. The compositor blends the
+layers itself, so blend time is the composite frame's self time, after the
+layers' frame, mask and position calls are taken out; frames reused from
+the previous one show up as composite calls with almost no self time.
+
+The events are written as a Chrome trace (open it in Perfetto, speedscope
+or chrome://tracing for a per-frame flame chart) and summarized in a table
+of total and self time per layer and call.
+"""
+import json
+import time
+from contextlib import contextmanager
+
+from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
+
+from frame_writer import FrameWriter
+
+
+class FrameProfiler:
+    """
+    Collects nested timing events for the frames of one render.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.events = []
+        # One entry per open call: [label, kind, start, time spent in nested calls]
+        self._stack = []
+
+    def wrap(self, label, kind, func):
+        """
+        Return `func` timed as a `kind` call of the layer `label`.
+        """
+        def timed(*args, **kwargs):
+            entry = [label, kind, time.perf_counter(), 0.0]
+            self._stack.append(entry)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                end = time.perf_counter()
+                self._stack.pop()
+                duration = end - entry[2]
+                if self._stack:
+                    self._stack[-1][3] += duration
+                self.events.append((label, kind, entry[2] - self.origin, duration, duration - entry[3]))
+
+        return timed
+
+    def instrument(self, composite):
+        """
+        Wrap the composite frame and the calls made for each of its layers, in place.
+        """
+        composite.make_frame = self.wrap('composite', 'frame', composite.make_frame)
+        for i, clip in enumerate(composite.clips):
+            label = f'layer {i} {type(clip).__name__} @{clip.start:.2f}s'
+            clip.make_frame = self.wrap(label, 'get_frame', clip.make_frame)
+            clip.pos = self.wrap(label, 'position', clip.pos)
+            if clip.mask is not None:
+                clip.mask.make_frame = self.wrap(label, 'mask', clip.mask.make_frame)
+        return composite
+
+    @contextmanager
+    def profile_writer(self):
+        """
+        Time every frame handed to a video writer while the block runs.
+
+        With FrameWriter this is the time to queue the frame, including any
+        wait for a free buffer, not the pipe write itself.
+        """
+        writers = [FFMPEG_VideoWriter, FrameWriter]
+        originals = [writer.write_frame for writer in writers]
+        for writer, write_frame in zip(writers, originals):
+            writer.write_frame = self.wrap('writer', 'write_frame', write_frame)
+        try:
+            yield
+        finally:
+            for writer, write_frame in zip(writers, originals):
+                writer.write_frame = write_frame
+
+    def write_trace(self, path):
+        """
+        Write the events in the Chrome trace event format.
+        """
+        events = [{
+            'name': f'{label}: {kind}' if label not in ('composite', 'writer') else kind,
+            'cat': kind,
+            'ph': 'X',
+            'ts': start * 1e6,
+            'dur': duration * 1e6,
+            'pid': 0,
+            'tid': 0,
+            'args': {'layer': label},
+        } for label, kind, start, duration, _ in self.events]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def summary(self):
+        """
+        Per (layer, call) totals, sorted by self time.
+
+        :return: List of dicts with label, kind, calls, total_ms, self_ms and max_ms
+        """
+        rows = {}
+        for label, kind, _, duration, self_time in self.events:
+            row = rows.setdefault((label, kind), {'label': label, 'kind': kind, 'calls': 0,
+                                                   'total_ms': 0.0, 'self_ms': 0.0, 'max_ms': 0.0})
+            row['calls'] += 1
+            row['total_ms'] += duration * 1000
+            row['self_ms'] += self_time * 1000
+            row['max_ms'] = max(row['max_ms'], duration * 1000)
+        return sorted(rows.values(), key=lambda row: row['self_ms'], reverse=True)
+
+    def print_summary(self, limit=25):
+        rows = self.summary()
+        print(f"{'layer':<40} {'call':<12} {'calls':>7} {'total ms':>10} {'self ms':>10} {'mean ms':>8} {'max ms':>8}")
+        for row in rows[:limit]:
+            print(f"{row['label']:<40} {row['kind']:<12} {row['calls']:>7} {row['total_ms']:>10.1f} "
+                  f"{row['self_ms']:>10.1f} {row['total_ms'] / row['calls']:>8.2f} {row['max_ms']:>8.2f}")
+        if len(rows) > limit:
+            print(f"... {len(rows) - limit} more rows")
@@ -0,0 +1,256 @@
+"""
+Frame writer that overlaps compositing with encoding.
+
+moviepy's FFMPEG_VideoWriter writes each frame to ffmpeg's stdin as soon as
+it is composited, so the compositor waits on the pipe and the pipe waits on
+the compositor. FrameWriter copies each frame into one of a few
+preallocated buffers and hands it to a thread that drains the buffers into
+ffmpeg, so the next frames are composited while earlier ones are written.
+The number of buffers bounds how far the compositor can run ahead.
+
+Both sides count the time they spend waiting: the compositor for a free
+buffer (the encoder is behind) and the writer thread for a frame (the
+compositor is behind). Those stalls tell whether a larger queue would help.
+The writer thread also times its writes to the pipe, which block while
+ffmpeg encodes, and the final flush; that is the encoding time, most of
+which overlaps compositing.
+
+With pix_fmt='yuv420p' frames are converted to planar YUV 4:2:0 while they
+are queued, with the BT.601 limited-range matrix ffmpeg uses for libx264, so
+the pipe carries 1.5 instead of 3 bytes per pixel and ffmpeg has no
+conversion left to do.
+"""
+import queue
+import subprocess as sp
+import tempfile
+import threading
+import time
+
+import numpy as np
+from moviepy.config import get_setting
+
+
+# BT.601 limited-range rows for Y, U and V, per 8-bit RGB value
+YUV_MATRIX = np.array([
+    [0.256788, 0.504129, 0.097906],
+    [-0.148223, -0.290993, 0.439216],
+    [0.439216, -0.367788, -0.071427],
+], np.float32)
+
+
+class YUV420Converter:
+    """
+    Converts RGB frames of one size to yuv420p, reusing its scratch buffers.
+
+    Luma matches ffmpeg's conversion to within one level. Chroma is the
+    average of each 2x2 block, where ffmpeg's scaler uses a wider filter,
+    so fine colored detail comes out slightly different.
+    """
+
+    def __init__(self, size):
+        width, height = size
+        if width % 2 or height % 2:
+            raise ValueError(f"yuv420p needs an even frame size, got {width}x{height}")
+        self.size = size
+        self.rgb = np.empty((height, width, 3), np.float32)
+        self.luma = np.empty((height, width), np.float32)
+        self.rows = np.empty((height // 2, width // 2, 2, 3), np.float32)
+        self.blocks = np.empty((height // 2, width // 2, 3), np.float32)
+        self.chroma = np.empty((height // 2, width // 2, 2), np.float32)
+        self.luma_weights = YUV_MATRIX[0]
+        # The 2x2 sums are averaged through the weights
+        self.chroma_weights = np.ascontiguousarray(YUV_MATRIX[1:].T / 4)
+
+    def __call__(self, frame, out):
+        """
+        Write `frame` into the flat uint8 array `out` as Y, U and V planes.
+        """
+        width, height = self.size
+        rgb = self.rgb
+        np.copyto(rgb, frame, casting='unsafe')
+        planes = width * height
+
+        np.matmul(rgb, self.luma_weights, out=self.luma)
+        # +0.5 rounds on the truncating cast to uint8
+        self.luma += 16.5
+        np.copyto(out[:planes].reshape(height, width), self.luma, casting='unsafe')
+
+        pairs = rgb.reshape(height // 2, 2, width // 2, 2, 3)
+        np.add(pairs[:, 0], pairs[:, 1], out=self.rows)
+        np.add(self.rows[:, :, 0], self.rows[:, :, 1], out=self.blocks)
+        np.matmul(self.blocks, self.chroma_weights, out=self.chroma)
+        self.chroma += 128.5
+        quarter = planes // 4
+        np.copyto(out[planes:planes + quarter].reshape(height // 2, width // 2), self.chroma[..., 0],
+                  casting='unsafe')
+        np.copyto(out[planes + quarter:].reshape(height // 2, width // 2), self.chroma[..., 1],
+                  casting='unsafe')
+        return out
+
+
+def ffmpeg_command(filename, size, fps, codec='libx264', preset='medium', threads=None,
+                   audiofile=None, ffmpeg_params=None, pix_fmt='rgb24'):
+    """
+    ffmpeg command reading raw frames from stdin, as FFMPEG_VideoWriter builds it.
+
+    :param pix_fmt: Format of the piped frames, 'rgb24' or 'yuv420p'
+    """
+    cmd = [get_setting("FFMPEG_BINARY"), '-y', '-loglevel', 'error',
+           '-f', 'rawvideo', '-vcodec', 'rawvideo',
+           '-s', '%dx%d' % (size[0], size[1]), '-pix_fmt', pix_fmt,
+           '-r', '%.02f' % fps, '-an', '-i', '-']
+    if audiofile is not None:
+        cmd += ['-i', audiofile, '-acodec', 'copy']
+    cmd += ['-vcodec', codec, '-preset', preset]
+    if ffmpeg_params is not None:
+        cmd += ffmpeg_params
+    if threads is not None:
+        cmd += ['-threads', str(threads)]
+    if codec == 'libx264' and size[0] % 2 == 0 and size[1] % 2 == 0:
+        cmd += ['-pix_fmt', 'yuv420p']
+    return cmd + [filename]
+
+
+class FrameWriter:
+    """
+    Writes frames to a video file through a bounded queue and a writer thread.
+
+    Use it as a context manager, like FFMPEG_VideoWriter. ``compositor_stall``
+    and ``encoder_stall`` hold the seconds each side waited for the other,
+    and ``encode_time`` the seconds spent handing frames to ffmpeg and
+    waiting for it to finish the file.
+    """
+
+    def __init__(self, filename, size, fps, codec='libx264', preset='medium', threads=None,
+                 audiofile=None, ffmpeg_params=None, queue_size=4, pix_fmt='rgb24'):
+        """
+        :param size: (width, height) of the frames
+        :param audiofile: Encoded audio to mux in without re-encoding
+        :param queue_size: Number of frame buffers, the most frames in flight
+        :param pix_fmt: 'rgb24', or 'yuv420p' to convert frames before piping them
+        """
+        self.filename = filename
+        self.compositor_stall = 0.0
+        self.encoder_stall = 0.0
+        self.encode_time = 0.0
+        self.error = None
+
+        if pix_fmt == 'yuv420p':
+            self._convert = YUV420Converter(size)
+            shape = (size[0] * size[1] * 3 // 2,)
+        elif pix_fmt == 'rgb24':
+            self._convert = None
+            shape = (size[1], size[0], 3)
+        else:
+            raise ValueError(f"Unsupported pipe format {pix_fmt!r}")
+        self._free = queue.Queue()
+        for _ in range(max(1, queue_size)):
+            self._free.put(np.empty(shape, np.uint8))
+        self._ready = queue.Queue()
+
+        self._log = tempfile.TemporaryFile()
+        cmd = ffmpeg_command(filename, size, fps, codec, preset, threads, audiofile, ffmpeg_params, pix_fmt)
+        self.proc = sp.Popen(cmd, stdin=sp.PIPE, stdout=sp.DEVNULL, stderr=self._log)
+        self._thread = threading.Thread(target=self._drain, name='frame-writer', daemon=True)
+        self._thread.start()
+
+    def write_frame(self, frame):
+        """
+        Queue one HxWx3 frame, converted to uint8 like FFMPEG_VideoWriter does,
+        or to yuv420p.
+        """
+        start = time.perf_counter()
+        buffer = self._free.get()
+        self.compositor_stall += time.perf_counter() - start
+        if self.error is not None:
+            self._free.put(buffer)
+            raise IOError(self._failure())
+        if self._convert is not None:
+            self._convert(frame, buffer)
+        else:
+            np.copyto(buffer, frame, casting='unsafe')
+        self._ready.put(buffer)
+
+    def _drain(self):
+        while True:
+            start = time.perf_counter()
+            buffer = self._ready.get()
+            self.encoder_stall += time.perf_counter() - start
+            if buffer is None:
+                return
+            if self.error is None:
+                start = time.perf_counter()
+                try:
+                    self.proc.stdin.write(buffer.data)
+                except (OSError, ValueError) as err:
+                    # Keep recycling buffers so the compositor sees the error instead of blocking
+                    self.error = err
+                self.encode_time += time.perf_counter() - start
+            self._free.put(buffer)
+
+    def _failure(self):
+        self._log.seek(0)
+        log = self._log.read().decode(errors='replace')
+        return f"ffmpeg failed writing {self.filename}: {self.error or ''}\n{log}"
+
+    def close(self):
+        """
+        Write the queued frames and wait for ffmpeg to finish the file.
+        """
+        self._ready.put(None)
+        self._thread.join()
+        start = time.perf_counter()
+        try:
+            self.proc.stdin.close()
+        except OSError as err:
+            self.error = self.error or err
+        returncode = self.proc.wait()
+        self.encode_time += time.perf_counter() - start
+        try:
+            if self.error is not None or returncode:
+                raise IOError(self._failure())
+        finally:
+            self._log.close()
+
+    def abort(self):
+        """
+        Stop the writer thread and ffmpeg without finishing the file.
+        """
+        self.error = self.error or IOError("aborted")
+        self._ready.put(None)
+        self._thread.join()
+        self.proc.kill()
+        self.proc.wait()
+        self._log.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_clip(clip, filename, fps, codec='libx264', preset='medium', threads=None, audiofile=None,
+               ffmpeg_params=None, queue_size=4, pix_fmt='rgb24', stats=None):
+    """
+    Render `clip` to `filename` with a FrameWriter, at the frame times write_videofile uses.
+
+    :param audiofile: Encoded audio to mux in, see audio_mix.write_clip_audio
+    :param pix_fmt: Format of the piped frames, see FrameWriter
+    :param stats: Optional RenderStats receiving the ``encoding``,
+                  ``compositor_stall`` and ``encoder_stall`` times
+    """
+    times = np.arange(0, clip.duration, 1.0 / fps)
+    print(f"Writing {len(times)} frames to {filename}")
+    with FrameWriter(filename, clip.size, fps, codec, preset, threads, audiofile, ffmpeg_params,
+                     queue_size, pix_fmt) as writer:
+        for t in times:
+            writer.write_frame(clip.get_frame(t))
+    if stats is not None:
+        stats.add_time('encoding', writer.encode_time)
+        stats.add_time('compositor_stall', writer.compositor_stall)
+        stats.add_time('encoder_stall', writer.encoder_stall)
+    return filename
@@ -0,0 +1,188 @@
+"""
+Frame-level motion effects for still background images.
+
+The 'scale' animation used to run a full PIL resize of the 1920-tall image
+on every frame through clip.resize(lambda t: ...). KenBurnsZoom resizes the
+image once to its largest scale and then produces each frame with a single
+crop-and-resample of only the region that ends up on screen.
+
+Shake and wave used np.roll, which copies the whole frame for every axis.
+shift_clip pads the frame once with wrapped edges and returns each shifted
+frame as a view into that buffer. The offset curves below are shared with
+the position-based wiggle and bounce animations.
+"""
+
+import numpy as np
+from PIL import Image
+from moviepy.editor import ImageClip
+
+
+class KenBurnsZoom:
+    """
+    Zoom into a still image over time, one viewport-sized frame at a time.
+
+    Frames look like the image scaled by scale(t) and seen through a
+    viewport; the scaled image is centered horizontally and either centered
+    or top-aligned vertically, matching how moviepy places a resized clip
+    positioned at ('center', 'center') or at ('center', y).
+    """
+
+    def __init__(self, image, scale, max_scale, viewport, anchor='center', resample=Image.BILINEAR):
+        """
+        :param image: HxWx3 uint8 array, or a HxW float mask
+        :param scale: Function of t giving the zoom factor
+        :param max_scale: Largest factor the zoom is expected to reach
+        :param viewport: (width, height) of the visible area
+        :param anchor: 'center' or 'top', vertical alignment of the scaled image
+        :param resample: PIL filter used for the per-frame resample
+        """
+        self.ismask = image.ndim == 2
+        source = Image.fromarray(image.astype(np.float32) if self.ismask else image)
+        self.height, self.width = image.shape[:2]
+
+        # Oversize the source once so zooming in never upsamples
+        source_scale = max(max_scale, 1)
+        size = (int(round(self.width * source_scale)), int(round(self.height * source_scale)))
+        self.source = source.resize(size, Image.LANCZOS) if source_scale != 1 else source
+        self.source_scale = self.source.width / self.width
+
+        self.scale = scale
+        self.viewport = viewport
+        self.anchor = anchor
+        self.resample = resample
+
+    def window(self, s):
+        """
+        Output size and source box for zoom factor `s`.
+        """
+        scaled_width, scaled_height = self.width * s, self.height * s
+        out_width = min(int(scaled_width), self.viewport[0])
+        out_height = min(int(scaled_height), self.viewport[1])
+        x0 = (scaled_width - out_width) / 2
+        y0 = 0 if self.anchor == 'top' else (scaled_height - out_height) / 2
+        ratio = self.source_scale / s
+        box = (x0 * ratio, y0 * ratio, (x0 + out_width) * ratio, (y0 + out_height) * ratio)
+        return (out_width, out_height), box
+
+    def frame(self, t):
+        size, box = self.window(self.scale(t))
+        frame = np.asarray(self.source.resize(size, self.resample, box=box))
+        return frame if not self.ismask else frame.astype(np.float64)
+
+
+def zoom_clip(clip, scale, max_scale, viewport, anchor='center'):
+    """
+    Apply a KenBurnsZoom to a still ImageClip and its mask.
+
+    :param clip: ImageClip to zoom, already given its start, duration and position
+    :param scale: Function of t giving the zoom factor
+    :param max_scale: Largest factor the zoom is expected to reach
+    :param viewport: (width, height) of the video
+    :param anchor: 'center' or 'top', see KenBurnsZoom
+    :return: VideoClip producing viewport-sized zoomed frames
+    """
+    zoom = KenBurnsZoom(clip.img, scale, max_scale, viewport, anchor)
+    zoomed = clip.fl(lambda gf, t: zoom.frame(t))
+    if clip.mask is not None:
+        mask_zoom = KenBurnsZoom(clip.mask.img, scale, max_scale, viewport, anchor)
+        zoomed.mask = clip.mask.fl(lambda gf, t: mask_zoom.frame(t))
+    zoomed.size = zoom.window(scale(0))[0]
+    return zoomed
+
+
+def shake_offset(t, start_time, duration, shake_amplitude=2, shake_frequency=2):
+    """
+    Whole-pixel (dx, dy) of the background shake.
+    """
+    relative_t = (t - start_time) / duration
+    shake_x = shake_amplitude * np.sin(2 * np.pi * shake_frequency * relative_t)
+    shake_y = shake_amplitude * np.cos(2 * np.pi * shake_frequency * relative_t)
+    return int(shake_x), int(shake_y)
+
+
+def wave_offset(t, amplitude=5, frequency=1):
+    """
+    Whole-pixel (dx, dy) of the horizontal text wave.
+    """
+    return int(amplitude * np.sin(2 * np.pi * frequency * t)), 0
+
+
+def wiggle_offset(t, amplitude=1, frequency=2):
+    """
+    (dx, dy) of the vertical text wiggle.
+    """
+    return 0, amplitude * np.sin(2 * np.pi * frequency * t)
+
+
+def bounce_offset(t, duration, height=50):
+    """
+    (dx, dy) of the text bounce.
+    """
+    return 0, height * abs(np.sin(2 * np.pi * t / duration))
+
+
+class ShiftWindow:
+    """
+    Shift frames by whole pixels, wrapping around the edges like np.roll.
+
+    The frame is padded on every side with its own wrapped-around edges; a
+    frame shifted by (dx, dy) is then just a window into the padded buffer.
+    """
+
+    def __init__(self, max_offset):
+        self.pad = max_offset
+        self.buffer = None
+
+    def fill(self, frame):
+        """
+        Copy `frame` and its wrapped edges into the reused padded buffer.
+        """
+        p = self.pad
+        h, w = frame.shape[:2]
+        shape = (h + 2 * p, w + 2 * p) + frame.shape[2:]
+        if self.buffer is None or self.buffer.shape != shape or self.buffer.dtype != frame.dtype:
+            self.buffer = np.empty(shape, frame.dtype)
+        buf = self.buffer
+        if not p:
+            buf[...] = frame
+            return buf
+
+        rows = [(slice(0, p), slice(h - p, h)), (slice(p, p + h), slice(0, h)), (slice(p + h, None), slice(0, p))]
+        cols = [(slice(0, p), slice(w - p, w)), (slice(p, p + w), slice(0, w)), (slice(p + w, None), slice(0, p))]
+        for dst_rows, src_rows in rows:
+            for dst_cols, src_cols in cols:
+                buf[dst_rows, dst_cols] = frame[src_rows, src_cols]
+        return buf
+
+    def view(self, buffer, offset):
+        """
+        The frame shifted by `offset`, as a view into a filled buffer.
+        """
+        dx, dy = offset
+        dx = max(-self.pad, min(self.pad, dx))
+        dy = max(-self.pad, min(self.pad, dy))
+        h = buffer.shape[0] - 2 * self.pad
+        w = buffer.shape[1] - 2 * self.pad
+        return buffer[self.pad - dy:self.pad - dy + h, self.pad - dx:self.pad - dx + w]
+
+
+def shift_clip(clip, offset, max_offset):
+    """
+    Shift the frames of a clip by offset(t), like np.roll on both axes.
+
+    A still ImageClip is padded once and every frame is a view into that
+    buffer. Animated clips are copied once per frame into a reused padded
+    buffer, so the returned frame is only valid until the next one is made.
+    As with clip.fl, the mask is left as it is.
+
+    :param clip: Clip to shift
+    :param offset: Function of t giving whole-pixel (dx, dy)
+    :param max_offset: Largest absolute dx or dy the offset can reach
+    """
+    window = ShiftWindow(max_offset)
+    if isinstance(clip, ImageClip):
+        padded = window.fill(clip.img)
+        window.buffer = None
+        return clip.fl(lambda gf, t: window.view(padded, offset(t)))
+    return clip.fl(lambda gf, t: window.view(window.fill(gf(t)), offset(t)))
+
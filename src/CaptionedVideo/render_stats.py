@@ -0,0 +1,91 @@
+"""
+Timing and memory statistics for a render.
+
+generate_final_video fills a RenderStats with the wall time of each stage
+so a change to caption building, background building, compositing or
+encoding can be measured on its own. Compositing happens lazily while the
+video is written, so it is timed per frame. With frame_writer's queue the
+encoding time is measured on the writer thread and overlaps compositing,
+so the stages can add up to more than the wall time; with moviepy's
+writer the two run in turn and encoding is the rest of the write.
+"""
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb(who='self'):
+    """
+    Peak resident set size of this process, or of its finished children, in MB.
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return usage.ru_maxrss / scale
+
+
+class RenderStats:
+    """
+    Accumulated stage times and counters of one render.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.started = time.perf_counter()
+
+    def add_time(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time the body of a with-block as stage `name`.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def timed_frames(self, clip, name):
+        """
+        Make every frame `clip` produces count towards stage `name`.
+
+        :return: The clip, with its frame function wrapped in place
+        """
+        make_frame = clip.make_frame
+
+        def timed(t):
+            start = time.perf_counter()
+            frame = make_frame(t)
+            self.add_time(name, time.perf_counter() - start)
+            return frame
+
+        clip.make_frame = timed
+        return clip
+
+    def as_dict(self):
+        """
+        Stage times, counters, wall time and peak memory as plain JSON-ready values.
+        """
+        wall = time.perf_counter() - self.started
+        frames = self.counters.get('frames', 0)
+        return {
+            'wall_s': wall,
+            'fps': frames / wall if wall else 0.0,
+            'stages_s': dict(self.stages),
+            'counters': dict(self.counters),
+            'peak_rss_mb': peak_rss_mb(),
+            'peak_child_rss_mb': peak_rss_mb('children'),
+        }
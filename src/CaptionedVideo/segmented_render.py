@@ -0,0 +1,263 @@
+"""
+Segmented rendering across worker processes.
+
+write_videofile produces every frame in one Python process and only the
+encoder gets extra threads. write_segmented cuts the timeline at GOP
+boundaries and renders and encodes each segment in its own process. The
+encoded segments are joined with ffmpeg's concat demuxer without
+re-encoding, and the audio is encoded once and muxed at the end.
+
+Workers are forked so they inherit the already built clip; on platforms
+without fork the render falls back to a single frame_writer.write_clip call.
+
+write_incremental keeps the encoded segments of earlier renders. Each
+segment is named after a hash of the layers active in it (see
+segment_hash), so after a config change only the segments whose layers
+changed are rendered again.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from moviepy.config import get_setting
+from moviepy.tools import subprocess_call
+
+from audio_mix import write_clip_audio
+from frame_writer import FrameWriter, write_clip
+
+# Clip being rendered, inherited by the forked workers
+_clip = None
+
+# Bump when frame rendering changes, so no stale incremental segment is reused
+SEGMENT_VERSION = 1
+
+
+def count_frames(duration, fps):
+    """
+    Number of frames write_videofile produces for `duration` at `fps`.
+    """
+    return len(np.arange(0, duration, 1.0 / fps))
+
+
+def plan_segments(nframes, segments, gop):
+    """
+    Split `nframes` frames into at most `segments` ranges that start on GOP boundaries.
+
+    :return: List of (first_frame, end_frame) pairs covering every frame
+    """
+    gops = -(-nframes // gop)
+    gops_per_segment = max(1, -(-gops // max(1, segments)))
+    step = gops_per_segment * gop
+    return [(first, min(first + step, nframes)) for first in range(0, nframes, step)]
+
+
+def encoder_params(gop):
+    """
+    ffmpeg options that make every segment start on a keyframe and keep a fixed GOP.
+    """
+    return ['-g', str(gop), '-keyint_min', str(gop), '-sc_threshold', '0']
+
+
+def _memo_hits(clip):
+    """
+    Frames `clip` has reused so far, for composites with a timeline.FrameMemo.
+    """
+    memo = getattr(clip, 'memo', None)
+    return memo.hits if memo is not None else 0
+
+
+def _render_segment(args):
+    """
+    :return: Tuple of (filename, frames reused from the previous composite)
+    """
+    first, end, filename, fps, codec, preset, threads, ffmpeg_params, pix_fmt = args
+    start_hits = _memo_hits(_clip)
+    with FrameWriter(filename, _clip.size, fps, codec=codec, preset=preset,
+                     threads=threads, ffmpeg_params=ffmpeg_params, pix_fmt=pix_fmt) as writer:
+        for i in range(first, end):
+            writer.write_frame(_clip.get_frame(i * (1.0 / fps)))
+    return filename, _memo_hits(_clip) - start_hits
+
+
+def concat_segments(segment_files, filename, audiofile=None):
+    """
+    Join encoded segments into `filename` without re-encoding, muxing in `audiofile` if given.
+    """
+    list_path = filename + '.segments.txt'
+    with open(list_path, 'w') as f:
+        for path in segment_files:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+    cmd = [get_setting("FFMPEG_BINARY"), '-y', '-f', 'concat', '-safe', '0', '-i', list_path]
+    if audiofile is not None:
+        cmd += ['-i', audiofile, '-map', '0:v:0', '-map', '1:a:0']
+    cmd += ['-c', 'copy', filename]
+    try:
+        subprocess_call(cmd, logger=None)
+    finally:
+        os.remove(list_path)
+
+
+def render_segments(clip, segments, directory, fps, codec='libx264', preset='medium', workers=None, gop=None,
+                    pix_fmt='rgb24'):
+    """
+    Render frame ranges of `clip` to separate files in worker processes.
+
+    :param segments: List of (first_frame, end_frame, filename)
+    :param pix_fmt: Format of the frames piped to ffmpeg, see frame_writer.FrameWriter
+    :return: Tuple of (written filenames in segment order, frames the
+             workers reused from their previous composite)
+    """
+    global _clip
+
+    workers = workers or multiprocessing.cpu_count()
+    gop = gop or int(round(fps * 2))
+    threads = max(1, multiprocessing.cpu_count() // workers)
+    jobs = [(first, end, os.path.join(directory, name), fps, codec, preset, threads, encoder_params(gop), pix_fmt)
+            for first, end, name in segments]
+
+    _clip = clip
+    try:
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            results = list(executor.map(_render_segment, jobs))
+    finally:
+        _clip = None
+    return [filename for filename, _ in results], sum(hits for _, hits in results)
+
+
+def write_segmented(clip, filename, fps, codec='libx264', audio_codec='aac', preset='medium',
+                    workers=None, gop=None, temp_dir=None, pix_fmt='rgb24'):
+    """
+    Render `clip` to `filename` in parallel segments.
+
+    :param clip: Clip to render, with its audio set
+    :param fps: Output frame rate
+    :param workers: Number of worker processes, defaults to the CPU count
+    :param gop: Keyframe interval in frames, defaults to two seconds
+    :param pix_fmt: Format of the frames piped to ffmpeg, see frame_writer.FrameWriter
+    :param temp_dir: Where segment files are written, defaults to a temporary directory
+    :return: Number of frames reused from the previous composite
+    """
+    workers = workers or multiprocessing.cpu_count()
+    gop = gop or int(round(fps * 2))
+    nframes = count_frames(clip.duration, fps)
+    plan = plan_segments(nframes, workers, gop)
+    ext = os.path.splitext(filename)[1] or '.mp4'
+
+    work_dir = tempfile.mkdtemp(prefix='segments_', dir=temp_dir)
+    try:
+        audiofile = None
+        if clip.audio is not None:
+            audiofile = os.path.join(work_dir, 'audio.m4a')
+            write_clip_audio(clip.audio, audiofile, codec=audio_codec)
+
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            print("Segmented rendering needs fork; rendering in a single process.")
+            start_hits = _memo_hits(clip)
+            write_clip(clip, filename, fps, codec, preset, audiofile=audiofile, pix_fmt=pix_fmt)
+            return _memo_hits(clip) - start_hits
+
+        print(f"Rendering {len(plan)} segments in {min(workers, len(plan))} processes")
+        segments = [(first, end, f'segment_{i:04d}{ext}') for i, (first, end) in enumerate(plan)]
+        segment_files, hits = render_segments(clip, segments, work_dir, fps, codec, preset, workers, gop, pix_fmt)
+        concat_segments(segment_files, filename, audiofile)
+        return hits
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def segment_hash(clips, start, end, settings):
+    """
+    Content hash of the frames between `start` and `end`, or None if it is unknown.
+
+    Every clip overlapping the range contributes its ``signature`` attribute
+    and its timing, in layer order. A clip without a signature makes the
+    segment uncacheable.
+    """
+    layers = []
+    for clip in clips:
+        clip_end = clip.end if clip.end is not None else float('inf')
+        if clip.start >= end or clip_end <= start:
+            continue
+        signature = getattr(clip, 'signature', None)
+        if signature is None:
+            return None
+        layers.append((signature, round(clip.start, 6), round(clip_end, 6)))
+    return hashlib.sha256(repr((settings, start, end, layers)).encode()).hexdigest()
+
+
+def write_incremental(clip, filename, fps, settings, codec='libx264', audio_codec='aac', preset='medium',
+                      workers=None, segment_seconds=2.0, pix_fmt='rgb24'):
+    """
+    Render a composite clip to `filename`, reusing unchanged segments of earlier renders.
+
+    Segments are kept next to the output in ``<filename>.segments`` with a
+    ``manifest.json`` listing the hash of every segment of the last render.
+
+    :param clip: Composite clip whose layers carry ``signature`` attributes
+    :param settings: Anything else the frames depend on, such as the video
+                     size; part of every segment hash
+    :param segment_seconds: Length of a segment, which is also the keyframe interval
+    :param pix_fmt: Format of the frames piped to ffmpeg, see frame_writer.FrameWriter
+    :return: Tuple of (number of segments rendered, number reused, frames
+             reused from the previous composite)
+    """
+    global _clip
+
+    gop = max(1, int(round(segment_seconds * fps)))
+    nframes = count_frames(clip.duration, fps)
+    plan = plan_segments(nframes, -(-nframes // gop), gop)
+    ext = os.path.splitext(filename)[1] or '.mp4'
+    settings = (SEGMENT_VERSION, settings, fps, codec, preset, gop, clip.size, pix_fmt)
+
+    segment_dir = filename + '.segments'
+    os.makedirs(segment_dir, exist_ok=True)
+    names = []
+    dirty = []
+    for i, (first, end) in enumerate(plan):
+        digest = segment_hash(clip.clips, first / fps, end / fps, settings)
+        name = f'{digest}{ext}' if digest else f'uncached_{i:04d}{ext}'
+        names.append(name)
+        if digest is None or not os.path.exists(os.path.join(segment_dir, name)):
+            dirty.append((first, end, name))
+
+    print(f"Rendering {len(dirty)} of {len(plan)} segments, reusing {len(plan) - len(dirty)}")
+    hits = 0
+    if dirty:
+        if 'fork' in multiprocessing.get_all_start_methods():
+            _, hits = render_segments(clip, dirty, segment_dir, fps, codec, preset, workers, gop, pix_fmt)
+        else:
+            _clip = clip
+            try:
+                for first, end, name in dirty:
+                    _, segment_hits = _render_segment((first, end, os.path.join(segment_dir, name), fps, codec,
+                                                       preset, multiprocessing.cpu_count(), encoder_params(gop),
+                                                       pix_fmt))
+                    hits += segment_hits
+            finally:
+                _clip = None
+
+    with tempfile.TemporaryDirectory(prefix='audio_', dir=segment_dir) as work_dir:
+        audiofile = None
+        if clip.audio is not None:
+            audiofile = os.path.join(work_dir, 'audio.m4a')
+            write_clip_audio(clip.audio, audiofile, codec=audio_codec)
+        concat_segments([os.path.join(segment_dir, name) for name in names], filename, audiofile)
+
+    # Keep only the segments of this render
+    for name in os.listdir(segment_dir):
+        if name.endswith(ext) and name not in names:
+            os.remove(os.path.join(segment_dir, name))
+    with open(os.path.join(segment_dir, 'manifest.json'), 'w') as f:
+        json.dump({'fps': fps, 'gop': gop,
+                   'segments': [{'first_frame': first, 'end_frame': end, 'file': name}
+                                for (first, end), name in zip(plan, names)]}, f, indent=2)
+    return len(dirty), len(plan) - len(dirty), hits
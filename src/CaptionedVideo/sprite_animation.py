@@ -0,0 +1,154 @@
+"""
+Analytic animations of sprite clips.
+
+moviepy animates a clip by wrapping its frame function, so resize(lambda t)
+or rotate(lambda t) resample the whole clip, and its mask, on every frame.
+Here an animation is a pose: a function of t giving the sprite's scale,
+rotation, mirroring and opacity. The compositor draws the still sprite in
+that pose straight into the frame. Translations and mirroring are plain
+array views and integer scales are broadcast blocks, so neither resamples
+or copies the sprite; only fractional scales and rotations go through one
+PIL resample per frame.
+"""
+import numpy as np
+from PIL import Image
+
+
+class Pose:
+    """
+    How a sprite is drawn at one moment.
+
+    The sprite is scaled about its top-left corner, mirrored horizontally
+    if `flip` is set, then rotated counterclockwise by `angle` degrees
+    about its center.
+    """
+    __slots__ = ('scale', 'angle', 'flip', 'opacity')
+
+    def __init__(self, scale=1, angle=0, flip=False, opacity=1.0):
+        self.scale = scale
+        self.angle = angle
+        self.flip = flip
+        self.opacity = opacity
+
+    def __eq__(self, other):
+        return (isinstance(other, Pose) and self.scale == other.scale and self.angle == other.angle
+                and self.flip == other.flip and self.opacity == other.opacity)
+
+
+def animate_sprite(clip, scale=None, angle=None, flip=False, opacity=None):
+    """
+    Give a sprite clip an analytic animation.
+
+    :param clip: Clip made with timeline.sprite_clip
+    :param scale: Function of t giving the scale factor
+    :param angle: Function of t giving the rotation in degrees, counterclockwise
+    :param flip: Whether the sprite is mirrored horizontally
+    :param opacity: Function of t multiplying the sprite's alpha
+    :return: Copy of the clip, drawn in that pose by the compositor
+    """
+    if getattr(clip, 'sprite_alpha', None) is None:
+        raise ValueError("animate_sprite needs a sprite clip")
+
+    def pose(t):
+        return Pose(scale(t) if scale else 1, angle(t) if angle else 0, flip, opacity(t) if opacity else 1.0)
+
+    clip = clip.copy()
+    clip.sprite_pose = pose
+    return clip
+
+
+def blend(frame, img, alpha, x, y, premultiplied=False):
+    """
+    Blend `img` with coverage `alpha` into `frame` at (x, y), in place.
+
+    Straight colors are blended with the same arithmetic as moviepy's masked
+    blit.
+    """
+    h, w = img.shape[:2]
+    hf, wf = frame.shape[:2]
+    x0, y0 = max(0, x), max(0, y)
+    x1, y1 = min(wf, x + w), min(hf, y + h)
+    if x0 >= x1 or y0 >= y1:
+        return frame
+
+    src = (slice(y0 - y, y1 - y), slice(x0 - x, x1 - x))
+    alpha = alpha[src]
+    region = frame[y0:y1, x0:x1]
+    if premultiplied:
+        region[...] = img[src] + (1.0 - alpha) * region
+    else:
+        region[...] = alpha * img[src] + (1.0 - alpha) * region
+    return frame
+
+
+def blend_upscaled(frame, img, alpha, x, y, factor):
+    """
+    Blend `img` enlarged by an integer `factor` with nearest-neighbour blocks, in place.
+
+    When the enlarged sprite lies inside the frame, the frame region is
+    viewed as factor x factor blocks and the sprite is broadcast over them.
+    """
+    h, w = img.shape[:2]
+    hf, wf = frame.shape[:2]
+    if x < 0 or y < 0 or x + w * factor > wf or y + h * factor > hf:
+        img = img.repeat(factor, axis=0).repeat(factor, axis=1)
+        alpha = alpha.repeat(factor, axis=0).repeat(factor, axis=1)
+        return blend(frame, img, alpha, x, y)
+
+    region = frame[y:y + h * factor, x:x + w * factor].reshape(h, factor, w, factor, -1)
+    alpha = alpha[:, None, :, None]
+    region[...] = alpha * img[:, None, :, None] + (1.0 - alpha) * region
+    return frame
+
+
+def resample(img, alpha, scale, angle):
+    """
+    Scale and rotate a sprite in one premultiplied PIL pass per step.
+
+    :return: Tuple of (premultiplied rgb, alpha, dx, dy) where dx, dy move the
+             result relative to the unrotated sprite's top-left corner
+    """
+    h, w = img.shape[:2]
+    rgba = np.empty((h, w, 4), np.uint8)
+    rgba[..., :3] = np.clip(img, 0, 255)
+    rgba[..., 3:] = np.clip(alpha * 255 + 0.5, 0, 255)
+    image = Image.fromarray(rgba, 'RGBA').convert('RGBa')
+
+    size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+    if size != (w, h):
+        image = image.resize(size, Image.BILINEAR)
+    if angle:
+        image = image.rotate(angle, Image.BICUBIC, expand=True)
+
+    out = np.asarray(image)
+    dx = (size[0] - image.width) // 2
+    dy = (size[1] - image.height) // 2
+    return out[..., :3], out[..., 3:] / 255.0, dx, dy
+
+
+def draw_sprite(frame, img, alpha, x, y, pose=None):
+    """
+    Draw a sprite with top-left corner (x, y) into `frame` in the given pose, in place.
+
+    :param img: HxWx3 sprite colors
+    :param alpha: HxWx1 float coverage
+    :param pose: Pose, or None for the sprite as it is
+    """
+    if pose is None:
+        return blend(frame, img, alpha, x, y)
+
+    if pose.flip:
+        img = img[:, ::-1]
+        alpha = alpha[:, ::-1]
+    if pose.opacity != 1:
+        alpha = alpha * pose.opacity
+
+    scale, angle = pose.scale, pose.angle % 360
+    if not angle:
+        if scale == 1:
+            return blend(frame, img, alpha, x, y)
+        if float(scale).is_integer() and scale > 1:
+            return blend_upscaled(frame, img, alpha, x, y, int(scale))
+
+    prem, alpha, dx, dy = resample(img, alpha, scale, angle)
+    return blend(frame, prem, alpha, x + dx, y + dy, premultiplied=True)
@@ -0,0 +1,204 @@
+"""
+In-process replacement for moviepy's TextClip.
+
+moviepy's TextClip runs ImageMagick's convert for every clip and reads the
+result back from a temporary PNG, so a reel with a few hundred shadowed
+captions starts a few hundred processes. TextClip here takes the same
+arguments and draws the text with PIL, with each font loaded once per
+process through text_engine.load_font. The update1.x notebooks import it
+in place of moviepy's, which makes ImageMagick and the policy.xml fix
+optional.
+
+Differences from ImageMagick's output are limited to rasterization:
+- Font names are looked up with fontconfig when they are not a file path.
+- ImageMagick strokes along the outline, half inside the glyph and half
+  outside; here the outline is the outer half, drawn under the fill, so a
+  stroke in the fill color (as the notebooks use it) looks the same.
+"""
+import os
+import shutil
+import subprocess
+import threading
+
+import numpy as np
+from moviepy.video.VideoClip import ImageClip
+from PIL import Image, ImageDraw
+
+from text_engine import load_font, parse_color, tint
+
+_font_files = {}
+_font_lock = threading.Lock()
+
+
+def find_font(font):
+    """
+    Path of a font given by file path or by name, like ImageMagick's -font.
+
+    Names are resolved once with fc-match; without fontconfig PIL looks for
+    a file of that name in the system font directories.
+    """
+    if os.path.exists(font):
+        return font
+    with _font_lock:
+        path = _font_files.get(font)
+        if path is None:
+            path = font
+            if shutil.which('fc-match'):
+                result = subprocess.run(['fc-match', '-f', '%{file}', font], capture_output=True, text=True)
+                if result.returncode == 0 and result.stdout:
+                    path = result.stdout
+            _font_files[font] = path
+    return path
+
+
+def wrap_text(text, font, width, kerning=0):
+    """
+    Break `text` into lines no wider than `width` pixels, at spaces.
+
+    Explicit line breaks are kept, and a word wider than `width` gets a line
+    of its own.
+    """
+    lines = []
+    for paragraph in text.split('\n'):
+        line = ''
+        for word in paragraph.split():
+            candidate = f'{line} {word}' if line else word
+            if line and line_width(candidate, font, kerning) > width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+    return lines
+
+
+def line_width(line, font, kerning=0):
+    return font.getlength(line) + kerning * max(0, len(line) - 1)
+
+
+def draw_lines(lines, font, positions, size, stroke_width=0, kerning=0):
+    """
+    Coverage mask of `lines` drawn at `positions`, with an outline of `stroke_width`.
+    """
+    image = Image.new('L', size, 0)
+    draw = ImageDraw.Draw(image)
+    for line, (x, y) in zip(lines, positions):
+        if kerning:
+            for i, char in enumerate(line):
+                draw.text((x + font.getlength(line[:i]) + i * kerning, y), char, font=font, fill=255,
+                          stroke_width=stroke_width, stroke_fill=255)
+        else:
+            draw.text((x, y), line, font=font, fill=255, stroke_width=stroke_width, stroke_fill=255)
+    return np.asarray(image)
+
+
+def layout_text(text, font_path, fontsize, size, method, stroke_width, kerning, interline):
+    """
+    Font, lines and block size of a text as TextClip lays it out.
+
+    For captions with a fixed size and no fontsize, the largest size that
+    fits is chosen, as ImageMagick does.
+    """
+    width, height = size if size is not None else (None, None)
+    if fontsize is None and method == 'caption' and width and height:
+        low, high = 1, height
+        while low < high:
+            mid = (low + high + 1) // 2
+            _, _, (w, h) = layout_text(text, font_path, mid, (width, None), method, stroke_width, kerning, interline)
+            if w <= width and h <= height:
+                low = mid
+            else:
+                high = mid - 1
+        fontsize = low
+
+    font = load_font(font_path, fontsize or 12)
+    if method == 'caption' and width:
+        lines = wrap_text(text, font, width - 2 * stroke_width, kerning)
+    else:
+        lines = text.split('\n')
+    ascent, descent = font.getmetrics()
+    line_height = ascent + descent + (interline or 0)
+    block_width = max(line_width(line, font, kerning) for line in lines)
+    block_height = line_height * len(lines) - (interline or 0)
+    return font, lines, (int(np.ceil(block_width)) + 2 * stroke_width, block_height + 2 * stroke_width)
+
+
+class TextClip(ImageClip):
+    """
+    Text clip drawn in-process, with the arguments of moviepy's TextClip.
+
+    :param txt: Text, may contain line breaks
+    :param filename: Read the text from this file instead
+    :param size: (width, height) of the clip; None in either entry fits it to
+                 the text. With method='caption' the text is wrapped to the width.
+    :param color: Fill color
+    :param bg_color: Background color, 'transparent' or None for none
+    :param fontsize: Size in pixels; with method='caption', a size and no
+                     fontsize, the largest size that fits is used
+    :param font: Font file, or a font name looked up with fontconfig
+    :param stroke_color: Outline color, or None for no outline
+    :param stroke_width: Outline width, as ImageMagick's -strokewidth
+    :param method: 'label' or 'caption'
+    :param kerning: Extra space between letters, in pixels
+    :param align: Gravity of the text in the clip, such as 'center', 'West' or 'NorthEast'
+    :param interline: Extra space between lines, in pixels
+
+    The ImageMagick-only arguments (tempfilename, temptxt, remove_temp,
+    print_cmd) are accepted and ignored.
+    """
+
+    def __init__(self, txt=None, filename=None, size=None, color='black',
+                 bg_color='transparent', fontsize=None, font='Courier',
+                 stroke_color=None, stroke_width=1, method='label',
+                 kerning=None, align='center', interline=None,
+                 transparent=True, **imagemagick_args):
+        if txt is None:
+            with open(filename, encoding='utf8') as f:
+                txt = f.read()
+
+        # ImageMagick strokes half outside the outline, and only with a stroke color
+        outline = int(np.ceil(stroke_width / 2)) if stroke_color is not None else 0
+        font, lines, (block_width, block_height) = layout_text(
+            txt, find_font(font), fontsize, size, method, outline, kerning or 0, interline)
+
+        width = block_width if size is None or size[0] is None else size[0]
+        height = block_height if size is None or size[1] is None else size[1]
+        align = align or 'center'
+        if 'West' in align:
+            x_anchor = 0.0
+        elif 'East' in align:
+            x_anchor = 1.0
+        else:
+            x_anchor = 0.5
+        if 'North' in align:
+            y_anchor = 0.0
+        elif 'South' in align:
+            y_anchor = 1.0
+        else:
+            y_anchor = 0.5
+
+        ascent, descent = font.getmetrics()
+        line_height = ascent + descent + (interline or 0)
+        top = int(round((height - block_height) * y_anchor)) + outline
+        positions = []
+        for i, line in enumerate(lines):
+            free = block_width - 2 * outline - line_width(line, font, kerning or 0)
+            left = int(round((width - block_width) * x_anchor + free * x_anchor)) + outline
+            positions.append((left, top + i * line_height))
+
+        fill = draw_lines(lines, font, positions, (width, height), 0, kerning or 0)
+        if outline:
+            stroke = draw_lines(lines, font, positions, (width, height), outline, kerning or 0)
+        else:
+            stroke = np.zeros_like(fill)
+        rgba = tint(fill, stroke, color, stroke_color)
+
+        if bg_color not in (None, 'transparent'):
+            alpha = rgba[..., 3:] / 255.0
+            rgba[..., :3] = np.clip(rgba[..., :3] * alpha + parse_color(bg_color) * (1 - alpha) + 0.5, 0, 255)
+            rgba[..., 3] = 255
+
+        ImageClip.__init__(self, rgba, transparent=transparent)
+        self.txt = txt
+        self.color = color
+        self.stroke_color = stroke_color
@@ -0,0 +1,235 @@
+"""
+Glyph-atlas text rendering for caption clips.
+
+Every glyph is rasterized once per font and size at the supersampled
+resolution, downscaled once and kept as a coverage mask; outlines are
+stroked by FreeType in the same single pass, once per stroke width. A
+caption is then built by blitting those masks into a buffer cropped to the
+text and tinting it, so no full-frame canvas is drawn or resampled per
+chunk. Colors are applied at tint time, which lets one atlas entry serve
+every color.
+"""
+import threading
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont, ImageColor
+
+SUPERSAMPLE = 2
+
+_fonts = {}
+_atlases = {}
+_registry_lock = threading.RLock()
+
+
+def load_font(font_path, size):
+    """
+    Load a TrueType font once and reuse it for every later request.
+    """
+    key = (font_path, size)
+    font = _fonts.get(key)
+    if font is None:
+        with _registry_lock:
+            font = _fonts.get(key)
+            if font is None:
+                font = _fonts[key] = ImageFont.truetype(font_path, size)
+    return font
+
+
+def get_atlas(font_path, font_size):
+    """
+    Return the shared GlyphAtlas for a font and size.
+    """
+    key = (font_path, font_size)
+    atlas = _atlases.get(key)
+    if atlas is None:
+        with _registry_lock:
+            atlas = _atlases.get(key)
+            if atlas is None:
+                atlas = _atlases[key] = GlyphAtlas(font_path, font_size)
+    return atlas
+
+
+def parse_color(color):
+    """
+    Convert a color name or hex string to an RGB float array.
+    """
+    return np.array(ImageColor.getrgb(color)[:3], dtype=np.float32)
+
+
+class GlyphAtlas:
+    """
+    Cache of per-glyph coverage masks for one font and size.
+
+    A glyph's fill mask is shared by every caption style; outlines are
+    rasterized once per stroke width. Glyphs are keyed by their sub-pixel
+    phase on the supersampled grid, so captions assembled from the atlas
+    line up exactly like text drawn in a single pass.
+    """
+
+    def __init__(self, font_path, font_size, supersample=SUPERSAMPLE):
+        self.font = load_font(font_path, font_size * supersample)
+        self.supersample = supersample
+        self.glyphs = {}
+        self._lock = threading.Lock()
+
+    def glyph(self, char, phase_x, phase_y, stroke_width=0):
+        """
+        Return (dx, dy, mask) for a glyph, rasterizing it on first use.
+
+        With a stroke_width the mask covers the glyph and its outline, as
+        draw.text draws them with the stroke in the fill color. dx and dy are
+        the offsets in output pixels of the mask from the pen position.
+        """
+        key = (char, phase_x, phase_y, stroke_width)
+        entry = self.glyphs.get(key)
+        if entry is None:
+            with self._lock:
+                entry = self.glyphs.get(key)
+                if entry is None:
+                    entry = self.glyphs[key] = self._rasterize(char, phase_x, phase_y, stroke_width)
+        return entry
+
+    def _rasterize(self, char, phase_x, phase_y, stroke_width):
+        ss = self.supersample
+        left, top, right, bottom = self.font.getbbox(char)
+        reach = stroke_width + 2 * ss
+        pad_x = -(-(max(0, -left) + reach) // ss) * ss
+        pad_y = -(-(max(0, -top) + reach) // ss) * ss
+        width = -(-(pad_x + phase_x + max(right, 0) + reach) // ss) * ss
+        height = -(-(pad_y + phase_y + max(bottom, 0) + reach) // ss) * ss
+
+        # FreeType strokes the outline in one pass, evenly in every direction
+        image = Image.new('L', (width, height), 0)
+        ImageDraw.Draw(image).text((pad_x + phase_x, pad_y + phase_y), char, font=self.font, fill=255,
+                                   stroke_width=stroke_width, stroke_fill=255)
+        mask = np.asarray(image.resize((width // ss, height // ss), Image.LANCZOS))
+
+        rows = np.flatnonzero(mask.any(axis=1))
+        cols = np.flatnonzero(mask.any(axis=0))
+        if not len(rows):
+            return 0, 0, np.zeros((0, 0), np.uint8)
+        y0, y1 = rows[0], rows[-1] + 1
+        x0, x1 = cols[0], cols[-1] + 1
+        return x0 - pad_x // ss, y0 - pad_y // ss, mask[y0:y1, x0:x1]
+
+    def text_bbox(self, text):
+        """
+        Bounding box of the text at the supersampled size, as draw.textbbox gives it.
+        """
+        return self.font.getbbox(text)
+
+    def coverage(self, text, origin=(0, 0), stroke_widths=(0,)):
+        """
+        Assemble coverage masks of `text` drawn at `origin`, one per stroke width.
+
+        `origin` is given in supersampled pixels, matching draw.text. Stroke
+        width 0 gives the plain fill. Returns (x, y, masks) where x and y
+        locate the equally sized, cropped masks in output pixels.
+        """
+        ss = self.supersample
+        pens = []
+        for i, char in enumerate(text):
+            if not char.isspace():
+                pens.append((char, int(round(origin[0] + self.font.getlength(text[:i]))), int(round(origin[1]))))
+
+        placed = []
+        for layer, stroke_width in enumerate(stroke_widths):
+            for char, pen_x, pen_y in pens:
+                dx, dy, mask = self.glyph(char, pen_x % ss, pen_y % ss, stroke_width)
+                if mask.size:
+                    placed.append((layer, pen_x // ss + dx, pen_y // ss + dy, mask))
+
+        if not placed:
+            empty = np.zeros((1, 1), np.uint8)
+            return int(origin[0]) // ss, int(origin[1]) // ss, [empty] * len(stroke_widths)
+
+        x0 = min(p[1] for p in placed)
+        y0 = min(p[2] for p in placed)
+        x1 = max(p[1] + p[3].shape[1] for p in placed)
+        y1 = max(p[2] + p[3].shape[0] for p in placed)
+        masks = [np.zeros((y1 - y0, x1 - x0), np.uint8) for _ in stroke_widths]
+        for layer, x, y, mask in placed:
+            h, w = mask.shape
+            region = masks[layer][y - y0:y - y0 + h, x - x0:x - x0 + w]
+            np.maximum(region, mask, out=region)
+        return x0, y0, masks
+
+
+def shade(fill, stroke, color, stroke_color=None):
+    """
+    Turn fill and stroke coverage into premultiplied RGB and alpha float arrays.
+
+    The stroke is laid under the fill, the same order the legacy renderer
+    drew them in.
+    """
+    fill = fill.astype(np.float32) / 255
+    stroke = stroke.astype(np.float32) / 255
+    # PIL's default ink is white when no stroke color is given
+    stroke_rgb = parse_color(stroke_color or 'white')
+    fill_rgb = parse_color(color)
+
+    stroke = stroke * (1 - fill)
+    alpha = fill + stroke
+    rgb = fill[..., None] * fill_rgb + stroke[..., None] * stroke_rgb
+    return rgb, alpha
+
+
+def to_rgba(rgb, alpha):
+    """
+    Convert premultiplied float RGB and alpha to a straight-alpha uint8 RGBA array.
+    """
+    rgb = np.divide(rgb, alpha[..., None], out=np.zeros_like(rgb), where=alpha[..., None] > 0)
+    rgba = np.empty(alpha.shape + (4,), np.uint8)
+    rgba[..., :3] = np.clip(rgb + 0.5, 0, 255)
+    rgba[..., 3] = np.clip(alpha * 255 + 0.5, 0, 255)
+    return rgba
+
+
+def tint(fill, stroke, color, stroke_color=None):
+    """
+    Turn fill and stroke coverage into a straight-alpha RGBA array.
+    """
+    return to_rgba(*shade(fill, stroke, color, stroke_color))
+
+
+def caption_origin(atlas, text, canvas_size):
+    """
+    Where the old renderer drew `text` centered on its 2x supersampled canvas.
+    """
+    ss = atlas.supersample
+    text_bbox = atlas.text_bbox(text)
+    text_width = text_bbox[2] - text_bbox[0]
+    text_height = text_bbox[3] - text_bbox[1]
+    return (canvas_size[0] * ss - text_width) // 2, (canvas_size[1] * ss - text_height) // 2
+
+
+def render_styled_caption(text, font_path, font_size, styles, canvas_size=(1920, 1080)):
+    """
+    Render a caption drawn in several stacked styles as one merged sprite.
+
+    The glyph coverage and every outline width are assembled once; each
+    style is a tint of that shared coverage, scaled by its opacity and
+    composited over the styles below it. A shadowed caption becomes one
+    sprite instead of two clips.
+
+    :param styles: List of (color, stroke_width, stroke_color, opacity), bottom first
+    :return: Tuple of (x, y, rgba) with the cropped RGBA array and its
+             top-left corner on the canvas
+    """
+    atlas = get_atlas(font_path, font_size)
+    origin = caption_origin(atlas, text, canvas_size)
+    stroke_widths = sorted({stroke_width for _, stroke_width, _, _ in styles if stroke_width})
+    x, y, masks = atlas.coverage(text, origin, [0] + stroke_widths)
+    fill = masks[0]
+    outlines = dict(zip(stroke_widths, masks[1:]))
+    outlines[0] = np.zeros_like(fill)
+
+    merged_rgb = np.zeros(fill.shape + (3,), np.float32)
+    merged_alpha = np.zeros(fill.shape, np.float32)
+    for color, stroke_width, stroke_color, opacity in styles:
+        rgb, alpha = shade(fill, outlines[stroke_width], color, stroke_color)
+        rgb *= opacity
+        alpha *= opacity
+        merged_rgb = rgb + merged_rgb * (1 - alpha[..., None])
+        merged_alpha = alpha + merged_alpha * (1 - alpha)
+    return x, y, to_rgba(merged_rgb, merged_alpha)
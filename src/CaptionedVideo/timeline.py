@@ -0,0 +1,279 @@
+"""
+Timeline indexing for composite clips.
+
+moviepy's CompositeVideoClip asks every clip whether it is playing on every
+frame, which gets slow once a subtitle file produces thousands of clips.
+The index here sweeps the clip intervals once so each frame only visits the
+clips that are active at that moment, and layers that end up fully hidden
+under opaque layers are cut from the timeline altogether.
+
+Sprites are still RGBA images, such as captions, whose alpha is kept as a
+plain array instead of a mask clip. The compositor blends them straight
+into its frame, which saves the mask lookup and the full-frame copy that
+moviepy's blit makes for every layer.
+
+Long stretches of a reel show the same frame: a still background, a caption
+without animation and the watermark. Before blending, the compositor
+gathers what every active layer would draw (its frame and mask arrays, its
+position and pose); when all of it is the same as for the previous frame,
+the previous composite is returned again. Still clips hand out the same
+array on every call, so the check costs a few lookups per layer.
+"""
+from bisect import bisect_right
+
+import numpy as np
+from moviepy.editor import CompositeVideoClip, ImageClip
+from moviepy.video.tools.drawing import blit
+
+from sprite_animation import draw_sprite
+
+
+class TimelineIndex:
+    """
+    Sorted sweep over the [start, end) intervals of a list of clips.
+
+    The timeline is cut at every clip boundary; for each span between two
+    consecutive boundaries the active clips are stored in layer order.
+    """
+
+    def __init__(self, clips):
+        bounds = sorted({c.start for c in clips} | {c.end for c in clips if c.end is not None})
+        starting = {}
+        ending = {}
+        for i, clip in enumerate(clips):
+            if clip.end is not None and clip.end <= clip.start:
+                continue
+            starting.setdefault(clip.start, []).append(i)
+            if clip.end is not None:
+                ending.setdefault(clip.end, []).append(i)
+
+        active = set()
+        spans = []
+        for bound in bounds:
+            active.difference_update(ending.get(bound, ()))
+            active.update(starting.get(bound, ()))
+            spans.append(tuple(clips[i] for i in sorted(active)))
+
+        self.bounds = bounds
+        self.spans = spans
+
+    def span_index(self, t):
+        """
+        Index of the span containing `t`, or -1 before the first clip starts.
+        """
+        return bisect_right(self.bounds, t) - 1
+
+    def clips_at(self, t):
+        """
+        Clips playing at time `t`, bottom layer first.
+        """
+        i = self.span_index(t)
+        return self.spans[i] if i >= 0 else ()
+
+
+class FrameMemo:
+    """
+    The last frame of a composite, with what its layers drew.
+
+    Copies of the clip made by set_duration, set_audio and the like share
+    it, so ``hits`` counts the reused frames of every copy.
+    """
+    __slots__ = ('last', 'hits')
+
+    def __init__(self):
+        # (layers, background, layer states, composite)
+        self.last = None
+        self.hits = 0
+
+
+class IndexedCompositeVideoClip(CompositeVideoClip):
+    """
+    CompositeVideoClip that looks up the playing clips through a TimelineIndex.
+
+    Accepts the same arguments as CompositeVideoClip and renders the same
+    frames; only the per-frame clip lookup changes, sprite layers are
+    blended in place with draw_sprite, and a frame whose layers draw the
+    same as in the previous frame is reused, see FrameMemo.
+    """
+
+    def __init__(self, clips, size=None, bg_color=None, use_bgclip=False, ismask=False):
+        transparent = bg_color is None and not (use_bgclip and clips[0].mask is None)
+        if bg_color is None:
+            bg_color = 0.0 if ismask else (0, 0, 0)
+        # The mask composite is built below, with sprite alphas as masks
+        CompositeVideoClip.__init__(self, clips, size=size, bg_color=bg_color,
+                                    use_bgclip=use_bgclip, ismask=ismask)
+        self.timeline = TimelineIndex(self.clips)
+        self.memo = FrameMemo()
+
+        if transparent:
+            self.bg_color = None
+            self.mask = IndexedCompositeVideoClip([layer_mask(c) for c in self.clips], self.size,
+                                                  ismask=True, bg_color=0.0)
+
+        def make_frame(t):
+            bg = f = self.bg.get_frame(t)
+            clips = self.timeline.clips_at(t)
+            if self.ismask:
+                for c in clips:
+                    f = c.blit_on(f, t)
+                return f
+
+            states = [layer_state(c, t, f.shape[:2]) for c in clips]
+            last = self.memo.last
+            if (last is not None and last[0] == clips and last[1] is bg
+                    and all(same_state(a, b) for a, b in zip(last[2], states))):
+                self.memo.hits += 1
+                return last[3]
+
+            for c, (img, mask, x, y, pose) in zip(clips, states):
+                if getattr(c, 'sprite_alpha', None) is None:
+                    f = blit(img, f, (x, y), mask=mask)
+                else:
+                    if f is bg:
+                        f = f.copy()
+                    draw_sprite(f, img, mask, x, y, pose)
+            self.memo.last = (clips, bg, states, f)
+            return f
+
+        self.make_frame = make_frame
+
+    def playing_clips(self, t=0):
+        return list(self.timeline.clips_at(t))
+
+
+def split_sprite(rgba):
+    """
+    Split an RGBA image into the read-only (rgb, alpha) pair sprite clips draw from.
+
+    Alpha is scaled to [0, 1] with a trailing axis, as blit expects of a mask.
+    """
+    rgb = np.ascontiguousarray(rgba[..., :3])
+    alpha = rgba[..., 3:] / 255.0
+    rgb.setflags(write=False)
+    alpha.setflags(write=False)
+    return rgb, alpha
+
+
+def sprite_clip(image, alpha=None):
+    """
+    Still clip for an RGBA image, with its alpha kept as a sprite instead of a mask clip.
+
+    Effects that only move the clip or change its colors keep working.
+    Scale or rotate it with sprite_animation.animate_sprite.
+
+    :param image: RGBA image, or the rgb half of a pair from split_sprite
+    :param alpha: alpha half of that pair; the clip then holds both arrays as they are
+    """
+    if alpha is None:
+        image, alpha = split_sprite(image)
+    clip = ImageClip(image)
+    clip.sprite_alpha = alpha
+    return clip
+
+
+def layer_mask(clip):
+    """
+    Mask of one layer, placed and timed like the layer, for the composite mask.
+
+    Animated sprites contribute their alpha in the rest pose.
+    """
+    alpha = getattr(clip, 'sprite_alpha', None)
+    if alpha is not None:
+        mask = ImageClip(alpha[..., 0], ismask=True)
+    else:
+        mask = clip.mask if clip.mask is not None else clip.add_mask().mask
+    return mask.set_position(clip.pos).set_end(clip.end).set_start(clip.start, change_end=False)
+
+
+def layer_position(clip, t, frame_size, image_size):
+    """
+    Top-left corner of a clip's frame on the composite, resolved like VideoClip.blit_on.
+
+    :param frame_size: (height, width) of the composite frame
+    :param image_size: (height, width) of the clip's frame
+    """
+    hf, wf = frame_size
+    hi, wi = image_size
+    pos = clip.pos(t)
+    if isinstance(pos, str):
+        pos = {'center': ['center', 'center'],
+               'left': ['left', 'center'],
+               'right': ['right', 'center'],
+               'top': ['center', 'top'],
+               'bottom': ['center', 'bottom']}[pos]
+    else:
+        pos = list(pos)
+
+    if clip.relative_pos:
+        for i, dim in enumerate([wf, hf]):
+            if not isinstance(pos[i], str):
+                pos[i] = dim * pos[i]
+
+    if isinstance(pos[0], str):
+        pos[0] = {'left': 0, 'center': (wf - wi) / 2, 'right': wf - wi}[pos[0]]
+    if isinstance(pos[1], str):
+        pos[1] = {'top': 0, 'center': (hf - hi) / 2, 'bottom': hf - hi}[pos[1]]
+    return int(pos[0]), int(pos[1])
+
+
+def layer_state(clip, t, frame_size):
+    """
+    Everything a layer draws at time `t`, as (img, mask, x, y, pose).
+
+    Sprites give their alpha as the mask and their pose, or None; other
+    layers give their mask frame, with the frame padded to the mask's size
+    as VideoClip.blit_on does.
+    """
+    ct = t - clip.start
+    img = clip.get_frame(ct)
+    alpha = getattr(clip, 'sprite_alpha', None)
+    if alpha is not None:
+        pose = getattr(clip, 'sprite_pose', None)
+        x, y = layer_position(clip, ct, frame_size, img.shape[:2])
+        return img, alpha, x, y, pose(ct) if pose is not None else None
+
+    mask = clip.mask.get_frame(ct) if clip.mask is not None else None
+    if mask is not None and img.shape[:2] != mask.shape[:2]:
+        img = clip.fill_array(img, mask.shape)
+    x, y = layer_position(clip, ct, frame_size, img.shape[:2])
+    return img, mask, x, y, None
+
+
+def same_state(a, b):
+    """
+    Whether two layer states draw the same pixels: the same arrays, position and pose.
+    """
+    return a[0] is b[0] and a[1] is b[1] and a[2:] == b[2:]
+
+
+def covers_frame(clip, size):
+    """
+    Whether a clip centered on a frame of `size` hides the whole frame.
+
+    The clip has to be a still image at least as large as the frame, with no
+    transparent pixels.
+    """
+    if clip.mask is not None:
+        mask = getattr(clip.mask, 'img', None)
+        if mask is None or mask.min() < 1:
+            return False
+    return clip.size[0] >= size[0] and clip.size[1] >= size[1]
+
+
+def cull_occluded_layers(clips, cover_times):
+    """
+    End every layer as soon as a layer above it covers the whole frame.
+
+    :param clips: Layers, bottom first
+    :param cover_times: For each layer, the time from which it hides everything
+                        below it (after any slide-in), or None if it never does
+    :return: List of clips with the hidden tails cut off
+    """
+    culled = []
+    for i, clip in enumerate(clips):
+        covered_at = min((t for t in cover_times[i + 1:] if t is not None), default=None)
+        if covered_at is not None and (clip.end is None or covered_at < clip.end):
+            clip = clip.set_end(max(covered_at, clip.start))
+        culled.append(clip)
+    return culled
@@ -1,24 +1,18 @@
 # SLIDE UP ANIMATION ADDED
-# Install ImageMagick
-!apt update -qq
-!apt install -qq imagemagick
-
-# Verify ImageMagick installation
-!convert --version
+# Captions are drawn in-process by text_clip.py, so ImageMagick is optional.
+# To draw them with ImageMagick instead, set USE_IMAGEMAGICK = True below and
+# uncomment these lines:
+# !apt install -qq imagemagick
+# !convert --version
+# !sed -i '/<policy domain="path" rights="none" pattern="@\*"/d' /etc/ImageMagick-6/policy.xml
 
 !pip install pysrt
 !apt update &> /dev/null
-!apt install imagemagick &> /dev/null
 !apt install ffmpeg &> /dev/null
 !pip install moviepy pysrt
-!sed -i '/<policy domain="path" rights="none" pattern="@\*"/d' /etc/ImageMagick-6/policy.xml
 
 import os
 
-# Set the path to ImageMagick binary if needed
-os.environ['IMAGE_MAGICK_BINARY'] = '/usr/bin/convert'
-os.environ['PATH'] += os.pathsep + '/usr/bin'
-
 import pysrt
 from google.colab import files
 from moviepy.editor import VideoFileClip, ImageClip, TextClip, CompositeVideoClip, AudioFileClip, VideoClip
@@ -27,9 +21,18 @@ from moviepy.video.fx.all import fadein, fadeout
 import moviepy.audio.fx.all as afx
 
 from moviepy.config import change_settings
+# motion_effects.py, text_clip.py and text_engine.py have to sit next to this notebook (e.g. in /content)
+from motion_effects import shake_offset, shift_clip, wiggle_offset, bounce_offset
+
+USE_IMAGEMAGICK = False
 
-# Set the path to the ImageMagick binary
-change_settings({"IMAGEMAGICK_BINARY": "/usr/bin/convert"})
+if USE_IMAGEMAGICK:
+    # Set the path to the ImageMagick binary
+    os.environ['IMAGE_MAGICK_BINARY'] = '/usr/bin/convert'
+    os.environ['PATH'] += os.pathsep + '/usr/bin'
+    change_settings({"IMAGEMAGICK_BINARY": "/usr/bin/convert"})
+else:
+    from text_clip import TextClip
 
 def scale_effect(t, duration, max_scale=1.1, scale_up=True):
     """
@@ -42,10 +45,7 @@ def scale_effect(t, duration, max_scale=1.1, scale_up=True):
 
 def shake_effect(t, start_time, duration, shake_amplitude=2, shake_frequency=2):
     """Simple shake effect by modifying image position."""
-    relative_t = (t - start_time) / duration
-    shake_x = shake_amplitude * np.sin(2 * np.pi * shake_frequency * relative_t)
-    shake_y = shake_amplitude * np.cos(2 * np.pi * shake_frequency * relative_t)
-    return int(shake_x), int(shake_y)
+    return shake_offset(t, start_time, duration, shake_amplitude, shake_frequency)
 
 def create_background_image_sequence(config):
     """
@@ -71,13 +71,8 @@ def create_background_image_sequence(config):
         # Apply additional animations
         for animation in animations:
             if animation == 'shake' and i > 0:
-                def apply_shake(get_frame, t):
-                    shake_x, shake_y = shake_effect(t, start_time, duration)
-                    frame = get_frame(t)
-                    frame = np.roll(frame, int(shake_x), axis=1)  # Roll along x-axis
-                    frame = np.roll(frame, int(shake_y), axis=0)  # Roll along y-axis
-                    return frame
-                image_clip = image_clip.fl(lambda gf, t: apply_shake(gf, t))
+                # Shifted frames are views into a padded copy, no np.roll per frame
+                image_clip = shift_clip(image_clip, lambda t: shake_effect(t, start_time, duration), max_offset=2)
 
             elif animation == 'scale':
                 scale_up = i % 2 == 0
@@ -141,20 +136,20 @@ def create_background_image_sequence(config):
 
 #     return background_clips
 
-from moviepy.editor import TextClip, CompositeVideoClip
+from moviepy.editor import CompositeVideoClip
 
 def blink_effect(get_frame, t, blink_duration=0.5):
     return get_frame(t) if (t % (2 * blink_duration)) < blink_duration else np.zeros_like(get_frame(t))
 
 def wiggle_effect(t, amplitude=1, frequency=2):
-    return amplitude * np.sin(2 * np.pi * frequency * t)
+    return wiggle_offset(t, amplitude, frequency)[1]
 
 def flip_effect(gf, t, axis=0):
     frame = gf(t)
     return np.flip(frame, axis=axis)
 
 def bounce_effect(t, duration, height=50):
-    return 'center', height * abs(np.sin(2 * np.pi * t / duration))
+    return 'center', bounce_offset(t, duration, height)[1]
 
 
 def create_text_animation(word_clip, animation='fadein', fade_duration=0.5):